@@ -1,10 +1,49 @@
+import argparse
 import os
-from memory import Client
+from memory.trace import TRACER
 
 
 def cli():
-    workspace = os.getcwd()
+    parser = argparse.ArgumentParser(prog='memory')
+    parser.add_argument('--profile', action='store_true',
+                        help='record timings of hot paths, see `trace` command. same as MEMORY_TRACE=1')
+    parser.add_argument('--root', default=os.getcwd(),
+                        help='root node, config.json is in its parent. current directory by default')
+    parser.add_argument('--no-daemon', action='store_true', help="don't send subcommands to the running daemon")
+    commands = parser.add_subparsers(dest='command', metavar='command',
+                                     help='run headless and exit, the interactive client is started without one')
+
+    query = commands.add_parser('query', help='filter nodes by keywords')
+    query.add_argument('keywords', help="keywords split by space, '-' to read one query per line from stdin")
+    query.add_argument('--json', action='store_true', help='one json object per query')
+    query.add_argument('--limit', type=int, default=0, help='show at most this many nodes, 0 for all')
+    query.add_argument('--rank', action='store_true', help='best matches first instead of the filtered tree')
+
+    cat = commands.add_parser('cat', help='print content of a node')
+    cat.add_argument('path', help='path of node as shown by query, starting with name of root')
+    cat.add_argument('--json', action='store_true', help='content, summary and sub nodes as a json object')
+
+    ls = commands.add_parser('ls', help='list sub nodes of a node')
+    ls.add_argument('path', nargs='?', help='path of node as shown by query, root by default')
+    ls.add_argument('--json', action='store_true')
+
+    stats = commands.add_parser('stats', help='size of the tree and the most clicked nodes')
+    stats.add_argument('--json', action='store_true')
+    stats.add_argument('--top', type=int, default=10, help='how many of the most clicked nodes')
+
+    commands.add_parser('serve', help='keep workspace loaded and serve subcommands and editors over a unix socket, '
+                                      'until interrupted')
+
+    args = parser.parse_args()
+    TRACER.enabled = args.profile or os.environ.get('MEMORY_TRACE', '') not in ['', '0']
+
+    workspace = args.root
     if not os.path.exists(os.path.join(workspace, "index.md")):
         print('index.md not found under {}, are you in correct path ?'.format(workspace))
-        exit(0)
-    Client(os.path.join(workspace)).run()
+        exit(0 if args.command is None else 1)
+    if args.command is not None:
+        from memory import batch
+        exit(batch.run(args))
+
+    from memory import Client
+    Client(os.path.abspath(workspace)).run()
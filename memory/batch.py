@@ -0,0 +1,266 @@
+"""
+headless commands of `memory`, for scripts and editors. nothing of the TUI or prompt_toolkit is loaded.
+they are sent to the daemon of workspace if one is running, see daemon.py, otherwise served in process on a tree
+loaded lazily (or restored from tree index if there is one), writing nothing to workspace.
+"""
+import argparse
+import heapq
+import inspect
+import itertools
+import json
+import os
+import shutil
+import sys
+import typing
+
+from .concept import ConceptNode, TreeIndex, get_mtime
+from .config import Config
+from .errors import ErrorRequest
+from .search_engine import SearchEngine, SearchIndex
+from .trace import TRACER
+from .watcher import TreeWatcher
+
+
+def load_tree(config: Config, root_name: str) -> ConceptNode:
+    """root of a tree restored from tree index, or of a lazy one, nodes are loaded as far as they are visited"""
+    return TreeIndex(config).load(root_name) or ConceptNode(root_name, config, lazy=True)
+
+
+def find_node(root: ConceptNode, path: str) -> typing.Optional[ConceptNode]:
+    """node of path as shown by `memory query`, starting with name of root. only directories on the way are listed"""
+    names = [name for name in path.split(os.path.sep) if name]
+    if len(names) == 0 or names[0] != root.name:
+        return None
+    node = root
+    for name in names[1:]:
+        node = next((sub_node for sub_node in node.sub_nodes if sub_node.name == name), None)
+        if node is None:
+            return None
+    return node
+
+
+def query(root: ConceptNode, index: SearchIndex, raw_keywords: str, limit: int = 0, ranking: bool = False,
+          fuzzy: bool = False) -> typing.Dict[str, typing.Any]:
+    """alive nodes after filtering root with keywords, in dfs order or best first. all of them if limit is 0"""
+    search_engine = SearchEngine(root, index=index, fuzzy=fuzzy)
+    search_engine.add_keywords(raw_keywords)
+    if ranking:
+        nodes = heapq.nlargest(limit or search_engine.alive_count, search_engine.iter_alive_nodes_in_dfs_order(),
+                               key=search_engine.score)
+    else:
+        nodes = list(itertools.islice(search_engine.iter_alive_nodes_in_dfs_order(), limit or None))
+    return {
+        'keywords': search_engine.keywords,
+        'ignored': search_engine.miss_keywords,
+        'count': search_engine.alive_count,
+        'results': [{'path': node.concept_node.path,
+                     'summary': node.concept_node.summary,
+                     'matched': sorted(node.matched_keyword),
+                     'clicks': node.concept_node.sub_tree_click_count} for node in nodes],
+    }
+
+
+def cat(node: ConceptNode) -> typing.Dict[str, typing.Any]:
+    return {
+        'path': node.path,
+        'summary': node.summary,
+        'content': ''.join(node.content),
+        'sub_nodes': [sub_node.name for sub_node in node.sub_nodes],
+        'clicks': node.click_count,
+    }
+
+
+def stats(root: ConceptNode, top: int = 10) -> typing.Dict[str, typing.Any]:
+    """size of the whole tree and its most clicked nodes"""
+    nodes = root.all_nodes_below
+    return {
+        'nodes': len(nodes),
+        'depth': max([node.path.count(os.path.sep) for node in nodes]) - root.path.count(os.path.sep),
+        'clicks': root.sub_tree_click_count,
+        'top': [{'path': node.path, 'clicks': node.click_count}
+                for node in heapq.nlargest(top, nodes, key=lambda node: node.click_count) if node.click_count],
+    }
+
+
+class Workspace(object):
+    """
+    requests on a loaded tree, served in process or by the daemon to other processes, see DaemonClient.
+    a request is an op with json-able params and result, it raises ErrorRequest if it can't be done.
+    if there is a watcher, changes made outside are applied before each request
+    """
+
+    def __init__(self, config: Config, root: ConceptNode, watcher: TreeWatcher = None):
+        self.config = config
+        self.root = root
+        self.search_index = SearchIndex(config.keyword_combiner)
+        self.watcher = watcher
+        self._ops = {'query': self.query, 'cat': self.cat, 'ls': self.ls, 'stats': self.stats,
+                     'mkdir': self.mkdir, 'mv': self.mv, 'refresh': self.refresh}
+
+    def request(self, op: str, **params) -> typing.Any:
+        func = self._ops.get(op, None)
+        if func is None:
+            raise ErrorRequest('unknown request: {}'.format(op))
+        try:
+            inspect.signature(func).bind(**params)
+        except TypeError as err:
+            raise ErrorRequest('{}: {}'.format(op, err))
+        if self.watcher is not None:
+            for (change, node) in self.watcher.poll():
+                if change == 'remove':
+                    self.search_index.remove_sub_tree(node)
+                else:
+                    self.search_index.update(node)
+        return func(**params)
+
+    def close(self):
+        if self.watcher is not None:
+            self.watcher.close()
+
+    def node(self, path: str) -> ConceptNode:
+        node = find_node(self.root, path)
+        if node is None:
+            raise ErrorRequest('{} not found under {}'.format(path, self.root.abs_path))
+        return node
+
+    def query(self, keywords: str, limit: int = 0, rank: bool = False) -> typing.Dict[str, typing.Any]:
+        return query(self.root, self.search_index, keywords, limit, rank or self.config.rank_search_results,
+                     self.config.fuzzy_search)
+
+    def cat(self, path: str) -> typing.Dict[str, typing.Any]:
+        return cat(self.node(path))
+
+    def ls(self, path: str) -> typing.List[typing.Dict[str, typing.Any]]:
+        return [{'path': node.path, 'summary': node.summary, 'clicks': node.click_count}
+                for node in self.node(path).sub_nodes]
+
+    def stats(self, top: int = 10) -> typing.Dict[str, typing.Any]:
+        return stats(self.root, top)
+
+    def mkdir(self, path: str, name: str, content: str = '') -> typing.Dict[str, typing.Any]:
+        """create node `name` under path, content is written to its index.md"""
+        parent = self.node(path)
+        if not name or os.path.sep in name or name in ['.', '..']:
+            raise ErrorRequest('invalid name: {}'.format(name))
+        abs_path = os.path.join(parent.abs_path, name)
+        if os.path.exists(abs_path):
+            raise ErrorRequest('{} already exists under {}'.format(name, parent.path))
+        os.mkdir(abs_path)
+        with open(os.path.join(abs_path, 'index.md'), 'w') as fd:
+            fd.write(content or '\n---\n')
+        parent.add_sub_node(name)
+        return self.cat(os.path.join(parent.path, name))
+
+    def mv(self, path: str, to: str) -> typing.Dict[str, typing.Any]:
+        """move node of path under node of `to`"""
+        target, new_parent = self.node(path), self.node(to)
+        if target.parent is None or target.is_ancestor_of(new_parent):
+            raise ErrorRequest("{} can't be moved under {}".format(target.path, new_parent.path))
+        if target.name in [node.name for node in new_parent.sub_nodes]:
+            raise ErrorRequest('{} already exists under {}'.format(target.name, new_parent.path))
+        shutil.move(target.abs_path, new_parent.abs_path)
+        if self.config.click_journal is not None:
+            self.config.click_journal.move(target.abs_path, os.path.join(new_parent.abs_path, target.name))
+        target.parent.remove_sub_node(target)
+        new_parent.attach_sub_node(target)
+        return {'path': target.path}
+
+    def refresh(self, path: str) -> typing.Dict[str, typing.Any]:
+        """
+        re-read the node of path (or the nearest ancestor still there), after another process changed it.
+        return path of the node refreshed and if anything changed
+        """
+        names = [name for name in path.split(os.path.sep) if name]
+        if len(names) == 0 or names[0] != self.root.name:
+            raise ErrorRequest('{} not found under {}'.format(path, self.root.abs_path))
+        node = self.root
+        for name in names[1:]:
+            sub_node = next((sub_node for sub_node in node.sub_nodes if sub_node.name == name), None)
+            if sub_node is None:
+                break
+            node = sub_node
+        # a lazy node whose content was never read is not reloaded by sync_content(), but may be in search index
+        content_changed = get_mtime(node.content_abs_path) not in [-1, node.content_mtime]
+        node.sync_content()
+        if content_changed:
+            self.search_index.update(node)
+        added, removed = node.sync_sub_nodes()
+        for removed_node in removed:
+            self.search_index.remove_sub_tree(removed_node)
+        return {'path': node.path, 'changed': content_changed or len(added) > 0 or len(removed) > 0}
+
+
+def _print_query(result: typing.Dict[str, typing.Any], as_json: bool):
+    if as_json:
+        print(json.dumps(result, ensure_ascii=False))
+        return
+    for record in result['results']:
+        print('{}\t{}'.format(record['path'], record['summary']))
+
+
+def run(args: argparse.Namespace) -> int:
+    """run subcommand parsed by __main__.cli(), return exit code"""
+    from .daemon import Daemon, DaemonClient
+
+    workspace_path, root_name = os.path.split(os.path.abspath(args.root))
+    config = Config(workspace_path, read_only=args.command != 'serve')
+    workspace = None  # type: typing.Union[Workspace, DaemonClient, None]
+    try:
+        if args.command == 'serve':
+            Daemon(config, root_name).serve_forever()
+            return 0
+        workspace = None if args.no_daemon else DaemonClient.connect(config)
+        if workspace is None:
+            workspace = Workspace(config, load_tree(config, root_name))
+        return _run(args, workspace, root_name)
+    except ErrorRequest as err:
+        print(err, file=sys.stderr)
+        return 1
+    finally:
+        if workspace is not None:
+            workspace.close()
+        if TRACER.enabled:
+            TRACER.dump(config.trace_file_path)
+
+
+def _run(args: argparse.Namespace, workspace: typing.Union[Workspace, "DaemonClient"], root_name: str) -> int:
+    if args.command == 'query':
+        if args.keywords != '-':
+            _print_query(workspace.request('query', keywords=args.keywords, limit=args.limit, rank=args.rank),
+                         args.json)
+            return 0
+        # one query per line, tree and index are shared by all of them
+        for (idx, line) in enumerate(sys.stdin):
+            if not args.json and idx > 0:
+                print()
+            _print_query(workspace.request('query', keywords=line.strip(), limit=args.limit, rank=args.rank),
+                         args.json)
+            sys.stdout.flush()
+        return 0
+
+    if args.command == 'cat':
+        result = workspace.request('cat', path=args.path)
+        if args.json:
+            print(json.dumps(result, ensure_ascii=False))
+        else:
+            sys.stdout.write(result['content'])
+        return 0
+
+    if args.command == 'ls':
+        result = workspace.request('ls', path=args.path or root_name)
+        if args.json:
+            print(json.dumps(result, ensure_ascii=False))
+        else:
+            for record in result:
+                print('{}\t{}'.format(record['path'], record['summary']))
+        return 0
+
+    assert args.command == 'stats'
+    result = workspace.request('stats', top=args.top)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+    else:
+        print('nodes   {}\ndepth   {}\nclicks  {}'.format(result['nodes'], result['depth'], result['clicks']))
+        for record in result['top']:
+            print('{:>7} {}'.format(record['clicks'], record['path']))
+    return 0
@@ -0,0 +1,4 @@
+from .runner import run_benchmarks
+from .workspace import generate_workspace
+
+__all__ = ['generate_workspace', 'run_benchmarks']
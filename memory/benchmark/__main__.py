@@ -0,0 +1,62 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+
+from .runner import run_benchmarks
+from .workspace import generate_workspace
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m memory.benchmark',
+                                     description='time memory on a synthetic workspace, print results as json')
+    parser.add_argument('--nodes', type=int, default=1000, help='concept nodes to generate')
+    parser.add_argument('--depth', type=int, default=6, help='max levels below root')
+    parser.add_argument('--fan-out', type=int, default=8, help='max sub nodes of a node')
+    parser.add_argument('--note-size', type=int, default=400, help='chars of each index.md')
+    parser.add_argument('--synonyms', type=int, default=50, help='groups of combines in config.json')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keywords', default=None, help='keywords to search, 3 random words by default')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of each case')
+    parser.add_argument('--workspace', default=None, help='generate workspace here and keep it, a temp dir by default')
+    parser.add_argument('--output', default=None, help='write results to this file instead of stdout')
+    args = parser.parse_args()
+
+    workspace = args.workspace if args.workspace is not None else tempfile.mkdtemp(prefix='memory-benchmark-')
+    try:
+        root_path = os.path.join(workspace, 'root')
+        if not os.path.exists(root_path):
+            generate_workspace(workspace, args.nodes, args.depth, args.fan_out, args.note_size, args.synonyms,
+                               args.seed)
+        keywords = args.keywords
+        if keywords is None:
+            # words of root's summary, so they are sure to match something
+            with open(os.path.join(root_path, 'index.md'), 'r') as fd:
+                keywords = ' '.join(random.Random(args.seed).sample(fd.readline().split(), 3))
+
+        report = {
+            'params': {key: value for (key, value) in vars(args).items()
+                       if key not in ['workspace', 'output', 'keywords']},
+            'keywords': keywords,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': run_benchmarks(root_path, keywords, args.repeat),
+        }
+    finally:
+        if args.workspace is None:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w') as fd:
+            json.dump(report, fd, indent=2)
+
+
+if __name__ == '__main__':
+    main()
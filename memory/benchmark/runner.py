@@ -0,0 +1,78 @@
+import contextlib
+import io
+import os
+import statistics
+import time
+import typing
+
+from ..client import Client
+from ..concept import ConceptNode, TreeLoader
+from ..config import Config
+from ..search_engine import SearchEngine, SearchIndex
+
+
+def _measure(func: typing.Callable[[], typing.Any], repeat: int,
+             setup: typing.Callable[[], typing.Any] = None) -> typing.Dict[str, float]:
+    """seconds func takes, setup is called before each run and not timed"""
+    seconds = []  # type: typing.List[float]
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        begin = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - begin)
+    return {'first': seconds[0], 'min': min(seconds), 'median': statistics.median(seconds),
+            'mean': statistics.mean(seconds), 'repeat': repeat}
+
+
+def run_benchmarks(root_path: str, keywords: str, repeat: int = 5) -> typing.Dict[str, typing.Dict[str, float]]:
+    """time every case on the workspace of root_path, {case: {'min': seconds, ...}}. mv cases move nodes back"""
+    workspace, root_name = os.path.split(root_path)
+    config = Config(workspace)
+    results = {}  # type: typing.Dict[str, typing.Dict[str, float]]
+
+    # file system cache is warm after the first run, unless workspace is read the first time it isn't really cold
+    results['load'] = _measure(lambda: TreeLoader(config).load(root_name), repeat)
+    root = ConceptNode(root_name, config)
+
+    indexes = []  # type: typing.List[SearchIndex]
+    results['search_engine.build_index'] = _measure(
+        lambda: SearchEngine(root, index=indexes[-1]), repeat,
+        lambda: indexes.append(SearchIndex(config.keyword_combiner)))
+    index = indexes[-1]
+    results['search_engine.init'] = _measure(lambda: SearchEngine(root, index=index), repeat)
+
+    engines = []  # type: typing.List[SearchEngine]
+    results['search_engine.add_keywords'] = _measure(
+        lambda: engines[-1].add_keywords(keywords), repeat, lambda: engines.append(SearchEngine(root, index=index)))
+    results['search_engine.dfs'] = _measure(lambda: engines[-1].get_alive_nodes_in_dfs_order(), repeat)
+    results['search_engine.undo_keyword'] = _measure(
+        lambda: engines[-1].undo_keyword(), repeat, lambda: engines[-1].add_keywords(keywords.split(' ')[0]))
+
+    results['refresh'] = _measure(lambda: [node.refresh() for node in root.all_nodes_below], repeat)
+
+    client = Client(root_path)
+    sub_nodes = client.root.sub_nodes
+    if len(sub_nodes) >= 2:
+        moving, new_parent = sub_nodes[-1], sub_nodes[0]
+
+        def move_and_back():
+            # cmd_mv() looks names up in listing, which cmd_ls() cuts to the first 15 sub nodes
+            client.select(client.root)
+            client.list(client.root.sub_nodes)
+            client.cmd_mv('{} {}'.format(moving.name, new_parent.name))
+            client.select(new_parent)
+            client.list(new_parent.sub_nodes)
+            client.cmd_mv('{} ..'.format(moving.name))
+
+        results['client.mv'] = _measure(move_and_back, repeat)
+
+    def render():
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.tui._draw()
+
+    client.select(client.root)
+    # from scratch, and again with nothing changed on screen
+    results['tui.render'] = _measure(render, repeat, client.tui.invalidate)
+    results['tui.redraw'] = _measure(render, repeat)
+    return results
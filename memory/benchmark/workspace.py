@@ -0,0 +1,65 @@
+import json
+import os
+import random
+import typing
+
+
+def _make_vocabulary(rand: random.Random, size: int) -> typing.List[str]:
+    syllables = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'to', 'vi', 'ze', 'po', 'qu', 'dri', 'fen', 'gal', 'hor', 'jin']
+    words = set()  # type: typing.Set[str]
+    while len(words) < size:
+        words.add(''.join([rand.choice(syllables) for _ in range(rand.randint(2, 4))]))
+    return sorted(words)
+
+
+def generate_workspace(path: str, nodes: int = 1000, depth: int = 6, fan_out: int = 8, note_size: int = 400,
+                       synonyms: int = 50, seed: int = 0) -> str:
+    """
+    generate a workspace of `nodes` concept nodes under path, return path of its root node.
+    the tree is at most `depth` levels below root, every node has at most `fan_out` sub nodes and an index.md of
+    about `note_size` chars. config.json has `synonyms` groups of combines, 30% of nodes have clicks.
+    the same arguments always generate the same workspace.
+    """
+    rand = random.Random(seed)
+    vocabulary = _make_vocabulary(rand, 500)
+    os.makedirs(path, exist_ok=True)
+
+    # synonyms never appear in vocabulary, so combining them is single pass, see KeywordCombiner
+    combines = [[vocabulary[idx % len(vocabulary)], 'syn{}x'.format(idx), 'syn{}y'.format(idx)]
+                for idx in range(synonyms)]
+    with open(os.path.join(path, 'config.json'), 'w') as fd:
+        json.dump({'combines': combines}, fd, indent=2)
+
+    def write_note(dir_path: str):
+        summary = ' '.join([rand.choice(vocabulary) for _ in range(5)])
+        body = []  # type: typing.List[str]
+        while sum([len(word) + 1 for word in body]) < note_size:
+            body.append(rand.choice(vocabulary) if rand.random() > 0.05 else rand.choice(combines)[1])
+        with open(os.path.join(dir_path, 'index.md'), 'w') as fd:
+            fd.write('{}\n---\n{}\n'.format(summary, ' '.join(body)))
+        if rand.random() < 0.3:
+            with open(os.path.join(dir_path, 'statistics.json'), 'w') as fd:
+                json.dump({'click': rand.randint(1, 50)}, fd)
+
+    root = os.path.join(path, 'root')
+    os.makedirs(root, exist_ok=True)
+    write_note(root)
+
+    # (path, depth, sub nodes count) of nodes which can still have sub nodes
+    open_nodes = [(root, 0, 0)]
+    for idx in range(1, nodes):
+        if len(open_nodes) == 0:
+            break
+        pick = rand.randrange(len(open_nodes))
+        parent, parent_depth, sub_nodes_count = open_nodes[pick]
+        node = os.path.join(parent, '{}_{}'.format(rand.choice(vocabulary), idx))
+        os.mkdir(node)
+        write_note(node)
+        if sub_nodes_count + 1 >= fan_out:
+            open_nodes[pick] = open_nodes[-1]
+            open_nodes.pop()
+        else:
+            open_nodes[pick] = (parent, parent_depth, sub_nodes_count + 1)
+        if parent_depth + 1 < depth:
+            open_nodes.append((node, parent_depth + 1, 0))
+    return root
@@ -0,0 +1,183 @@
+import atexit
+import contextlib
+import json
+import os
+import threading
+import typing
+
+from .trace import TRACER
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # windows, compaction may drop clicks appended by another process at the same moment
+
+
+class ClickJournal(object):
+    """
+    click events of the whole workspace, kept in a single append-only file.
+
+    events are buffered in memory and appended in one batch after `flush_every` events, `flush_interval`
+    seconds after the first buffered one, or on exit. a batch is a single line, a crash can only tear the
+    last one, which is skipped on replay.
+
+    clicks counted here are on top of those saved in statistics.json of each node, unless consolidated:
+    then statistics.json of all nodes are migrated into the journal once, and never read again.
+    nodes are keyed by the path of their statistics.json relative to workspace, so moving or removing a
+    directory is journaled too.
+    """
+
+    def __init__(self, workspace: str, path: str, flush_every: int = 32, flush_interval: float = 5.0,
+                 consolidated: bool = False, read_only: bool = False):
+        self.workspace = workspace
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.consolidated = consolidated
+        self.read_only = read_only
+        self.migrated = False
+
+        self._clicks = {}  # type: typing.Dict[str, int]  # flushed and pending
+        self._pending = {}  # type: typing.Dict[str, int]
+        self._pending_events = 0
+        self._timer = None  # type: typing.Optional[threading.Timer]
+        self._lock = threading.RLock()
+
+        self._replay()
+        if self.consolidated and not self.migrated:
+            self._migrate()
+        atexit.register(self.flush)
+
+    def _key(self, abs_path: str) -> str:
+        return os.path.relpath(abs_path, self.workspace)
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as fd:
+            for line in fd:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # torn by a crash
+                self._apply(record)
+
+    def _migrate(self):
+        """import statistics.json of every node under workspace, in a single record. only in memory if read_only"""
+        clicks = {}  # type: typing.Dict[str, int]
+        for (dir_path, _, file_names) in os.walk(self.workspace):
+            if 'statistics.json' not in file_names:
+                continue
+            path = os.path.join(dir_path, 'statistics.json')
+            with open(path, 'r') as fd:
+                try:
+                    click = json.loads(''.join([line for line in fd])).get('click', 0)
+                except ValueError:
+                    continue
+            if click:
+                clicks[self._key(path)] = click
+        record = {'click': clicks, 'migrated': True}
+        if not self.read_only:
+            self._append(record)
+        self._apply(record)
+
+    def _apply(self, record: typing.Dict):
+        if record.get('migrated', False):
+            self.migrated = True
+        for (key, clicks) in record.get('click', {}).items():
+            self._clicks[key] = self._clicks.get(key, 0) + clicks
+        if 'move' in record:
+            old_prefix, new_prefix = [dir_key + os.path.sep for dir_key in record['move']]
+            for key in [key for key in self._clicks if key.startswith(old_prefix)]:
+                self._clicks[new_prefix + key[len(old_prefix):]] = self._clicks.pop(key)
+        if 'remove' in record:
+            prefix = record['remove'] + os.path.sep
+            for key in [key for key in self._clicks if key.startswith(prefix)]:
+                del self._clicks[key]
+
+    @contextlib.contextmanager
+    def _file_lock(self, exclusive: bool):
+        """shared by appends of all processes on workspace, exclusive for compaction which replaces the file"""
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+        finally:
+            os.close(fd)
+
+    def _append(self, record: typing.Dict):
+        data = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        with self._file_lock(exclusive=False):
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def clicks(self, statistics_path: str) -> int:
+        return self._clicks.get(self._key(statistics_path), 0)
+
+    def record_click(self, statistics_path: str):
+        key = self._key(statistics_path)
+        with self._lock:
+            self._clicks[key] = self._clicks.get(key, 0) + 1
+            self._pending[key] = self._pending.get(key, 0) + 1
+            self._pending_events += 1
+            if self._pending_events >= self.flush_every:
+                self.flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    @TRACER.timed('click_journal.flush')
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._pending_events == 0:
+                return
+            pending = self._pending
+            self._pending = {}
+            self._pending_events = 0
+            self._append({'click': pending})
+
+    def move(self, old_dir: str, new_dir: str):
+        """a directory is moved, along with clicks of everything under it"""
+        with self._lock:
+            self.flush()
+            record = {'move': [self._key(old_dir), self._key(new_dir)]}
+            self._append(record)
+            self._apply(record)
+
+    def remove(self, abs_dir: str):
+        """a directory is removed, forget clicks of everything under it"""
+        with self._lock:
+            self.flush()
+            record = {'remove': self._key(abs_dir)}
+            self._append(record)
+            self._apply(record)
+
+    @TRACER.timed('click_journal.compact')
+    def compact(self):
+        """rewrite the journal as one record per node, atomically replacing the old one"""
+        with self._lock:
+            self.flush()  # before locking, appending takes the shared lock
+            with self._file_lock(exclusive=True):
+                # others may have appended since this process replayed it, journal is the only copy of their clicks
+                self._clicks = {}
+                self._replay()
+                tmp_path = self.path + '.tmp'
+                record = {'click': {key: clicks for (key, clicks) in self._clicks.items() if clicks}}
+                if self.migrated:
+                    record['migrated'] = True
+                with open(tmp_path, 'w') as fd:
+                    print(json.dumps(record, ensure_ascii=False), file=fd)
+                    fd.flush()
+                    os.fsync(fd.fileno())
+                os.replace(tmp_path, self.path)
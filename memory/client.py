@@ -1,3 +1,4 @@
+import itertools
 import math
 import os
 import shutil
@@ -5,18 +6,20 @@ import sys
 
 import typing
 
-from .concept import ConceptNode
+from .concept import ConceptNode, TreeIndex, TreeLoader
 from .config import Config
-from .search_engine import SearchEngine, SearchableNode
-from .tui import _TUI
+from .daemon import DaemonClient
+from .live_search import LiveSearch
+from .search_engine import SearchEngine, SearchableNode, SearchIndex
+from .trace import TRACER
+from .tui import _TUI, fold_string
+from .watcher import TreeWatcher
 from .errors import *
 from .decorated_str import *
-from prompt_toolkit import prompt
 
 
 IS_WIN = sys.platform == "win32"
 EDITOR = "notepad" if IS_WIN else "vim"
-CLEAR_CMD = "cls" if IS_WIN else "clear"
 
 
 def ask_confirm(msg: typing.Union[str, DecoratedStr]):
@@ -33,7 +36,12 @@ class Client(object):
     def __init__(self, root_path: str):
         workspace, root_name = os.path.split(root_path)
         self.config = Config(workspace)
-        self.root = ConceptNode(root_name, self.config)
+        self.tree_index = TreeIndex(self.config)
+        self.root = self.tree_index.load(root_name) or TreeLoader(self.config).load(root_name)
+        self.search_index = SearchIndex(self.config.keyword_combiner)
+        self.watcher = TreeWatcher(self.root) if self.config.watch else None
+        # daemon serving this workspace to other processes, told about what is changed here
+        self.daemon = DaemonClient.connect(self.config)  # type: typing.Optional[DaemonClient]
         self.listing_nodes = []  # type: typing.List[ConceptNode]
 
         # use self.select() to modify this value
@@ -50,6 +58,31 @@ class Client(object):
         self.cmd_ls("")
         self.cmd_cat('')
 
+    def apply_external_changes(self):
+        """apply changes made outside memory to the tree and search index"""
+        if self.watcher is None:
+            return
+        changes = self.watcher.poll()
+        for (change, node) in changes:
+            if change == 'remove':
+                self.search_index.remove_sub_tree(node)
+                if node.is_ancestor_of(self.selected):
+                    self.selected = node.parent
+            else:
+                self.search_index.update(node)
+        if len(changes):
+            self.select(self.selected)
+
+    def notify_daemon(self, *nodes: ConceptNode):
+        """let the daemon re-read nodes changed here, for removed or moved nodes pass their parents"""
+        if self.daemon is None:
+            return
+        try:
+            for node in nodes:
+                self.daemon.request('refresh', path=node.path)
+        except ErrorRequest:
+            pass  # daemon is gone, or its tree differs from ours
+
     def cmd_exit(self, params: str):
         if params == '-h':
             self.cmd_help('exit')
@@ -63,13 +96,18 @@ class Client(object):
         self.listing_nodes = nodes
         self.tui.register_tui_block(
             'listing...',
-            ['[{:0>2d}]{}{}: {}'.format(
-                idx,
-                "🖱️{}{}".format(
-                    node.sub_tree_click_count, "" if not node.has_sub_nodes else "📚" + str(node.sub_tree_size - 1)),
-                node.decorated_name, node.summary)
+            ['[{:0>2d}]{}{}: {}'.format(idx, self.describe_sub_tree(node), node.decorated_name, node.summary)
              for (idx, node) in enumerate(nodes)], True)
 
+    @staticmethod
+    def describe_sub_tree(node: ConceptNode) -> str:
+        if not node.has_sub_tree_statistics:
+            # lazy mode: only count what is directly below, don't load the whole sub tree just for listing
+            return "🖱️{}+{}".format(
+                node.click_count, "" if not node.has_sub_nodes else "📚{}+".format(len(node.sub_nodes)))
+        return "🖱️{}{}".format(
+            node.sub_tree_click_count, "" if not node.has_sub_nodes else "📚" + str(node.sub_tree_size - 1))
+
     def cancel_list(self):
         self.tui.unregister_tui_block('listing...')
 
@@ -108,65 +146,122 @@ class Client(object):
         if target is not None:
             self.select(target)
 
+    @TRACER.timed('client.render_search_result')
+    def render_search_result(self, search_engine: SearchEngine, ranking: bool) -> \
+            typing.Tuple[typing.List[SearchableNode], typing.List[typing.Union[str, DecoratedStr]]]:
+        """(nodes shown, lines showing them) of what is alive in search_engine"""
+        if ranking:
+            alive_searchable_nodes = search_engine.get_top_ranked_nodes(self.config.max_showing_nodes_when_searching)
+        else:
+            # only walk as far as what can be shown
+            alive_searchable_nodes = list(itertools.islice(
+                search_engine.iter_alive_nodes_in_dfs_order(), self.config.max_showing_nodes_when_searching))
+
+        # build filtered tree, or a flat list when ranking
+        filtered_tui = []
+        tree_decoration = ""
+        last_depth = None
+        last_is_last_sub = False
+        for (idx, searchable_node) in enumerate(alive_searchable_nodes):
+            assert isinstance(searchable_node, SearchableNode)
+            is_last_sub = searchable_node.is_last_alive_sub_node
+            node = searchable_node.concept_node
+            depth = searchable_node.alive_depth
+            assert isinstance(node, ConceptNode)
+            tmp = DecoratedStr('[{:0>2d}] '.format(idx))
+
+            # if not depth and node.parent is not None:
+            #     tmp += node.parent.path + os.path.sep
+
+            if not ranking:
+                if last_depth is not None:
+                    if depth > last_depth:
+                        tree_decoration += "   " if last_is_last_sub else "║  "
+                    elif depth < last_depth:
+                        tree_decoration = tree_decoration[:-3 * (last_depth - depth)]
+                last_depth = depth
+                last_is_last_sub = is_last_sub
+
+                tmp += (tree_decoration + ("╠═ " if not is_last_sub else "╚═ "))[3:]
+            tmp += "🖱️{}".format(searchable_node.concept_node.sub_tree_click_count)
+            if node.has_sub_nodes:
+                tmp += "📚{}".format(node.sub_tree_size - 1)
+            if ranking:
+                # flat list, show the whole path under searching root
+                path = node.path[len(search_engine.root.concept_node.path):].lstrip(os.path.sep)
+            else:
+                path = searchable_node.get_path_under_alive_parent()
+            tmp += DecoratedStr(path[:path.rfind('/') + 1], [BLUE])
+            tmp += node.decorated_name
+            tmp += " " + node.summary
+            if len(searchable_node.matched_keyword) > 0:
+                tmp += " (🎯"
+                tmp += DecoratedStr(",".join(searchable_node.matched_keyword), [YELLOW])
+                tmp += ")"
+            filtered_tui.append(tmp)
+
+        nodes_hidden = search_engine.alive_count - len(alive_searchable_nodes)
+        if nodes_hidden:
+            buf = " {} items hidden ".format(nodes_hidden)
+            # fit in what _TUI shows of a line, see fold_string()
+            decorator = '-' * int(math.floor((self.tui.width - 8 - len(buf)) / 2))
+            filtered_tui.append('{}{}{}'.format(decorator, buf, decorator))
+        return alive_searchable_nodes, filtered_tui
+
+    @staticmethod
+    def typed_keywords(text: str) -> typing.List[str]:
+        """keywords in what is typed when searching, none if it is a command or an idx"""
+        if text.startswith(':') or text.strip().isdigit():
+            return []
+        return text.split(' ')
+
+    def prompt_keywords_live(self, message: str, search_engine: SearchEngine, ranking: bool) -> str:
+        """
+        prompt showing what typed keywords filter below it, updated on every key stroke.
+        when it returns, keywords typed are already added to search_engine
+        """
+        committed = search_engine.added_keywords
+        from prompt_toolkit import PromptSession
+        from prompt_toolkit.formatted_text import ANSI
+        from prompt_toolkit.styles import Style
+
+        session = PromptSession()
+        showing = []  # type: typing.List[str]
+
+        def on_result(lines: typing.List[typing.Union[str, DecoratedStr]]):
+            lines = [line if isinstance(line, DecoratedStr) else DecoratedStr(line) for line in lines]
+            showing[:] = [fold_string(line, self.tui.width - 1) for line in lines]
+            session.app.invalidate()
+
+        live_search = LiveSearch(search_engine, lambda engine: self.render_search_result(engine, ranking)[1], on_result)
+        session.default_buffer.on_text_changed += \
+            lambda buffer: live_search.update(committed + Client.typed_keywords(buffer.text))
+        try:
+            text = session.prompt(message, bottom_toolbar=lambda: ANSI('\n'.join(showing)) if len(showing) else None,
+                                  style=Style.from_dict({'bottom-toolbar': 'noreverse'}))
+        finally:
+            live_search.close()
+            # toolbar below the prompt may have scrolled screen
+            self.tui.invalidate()
+        search_engine.set_keywords(committed + Client.typed_keywords(text))
+        return text
+
     def search(self, under: ConceptNode, title='filtering') -> typing.Optional[ConceptNode]:
 
         self.tui.unregister_tui_block('listing...')
-        search_engine = SearchEngine(under, self.config.user_config['combines'])
+        search_engine = SearchEngine(under, index=self.search_index, fuzzy=self.config.fuzzy_search)
         self.tui.register_tui_block('select.2 tips', [
             '1. Memory will split your input automatically into several keywords by space char. ',
             "2. Use ' ' if u are not sure. eg. choose 'test engine' but not 'testEngine'.",
-            "3. Use 'Ctrl + C' or input ':q' to exit selecting"
+            "3. Use 'Ctrl + C' or input ':q' to exit selecting",
+            "4. Input ':r' to switch between the filtered tree and the best matches first",
+            "5. Input ':u' to remove the last keyword"
         ], False)
+        ranking = self.config.rank_search_results
 
         try:
             while True:
-                self.cmd_clear('')
-                alive_searchable_nodes = search_engine.get_alive_nodes_in_dfs_order()
-
-                # build filtered tree
-                filtered_tui = []
-                tree_decoration = ""
-                last_depth = None
-                last_is_last_sub = False
-                alive_searchable_nodes = alive_searchable_nodes[:self.config.max_showing_nodes_when_searching]
-                for (idx, searchable_node) in enumerate(alive_searchable_nodes):
-                    assert isinstance(searchable_node, SearchableNode)
-                    is_last_sub = searchable_node.is_last_alive_sub_node
-                    node = searchable_node.concept_node
-                    depth = searchable_node.alive_depth
-                    assert isinstance(node, ConceptNode)
-                    tmp = DecoratedStr('[{:0>2d}] '.format(idx))
-
-                    # if not depth and node.parent is not None:
-                    #     tmp += node.parent.path + os.path.sep
-
-                    if last_depth is not None:
-                        if depth > last_depth:
-                            tree_decoration += "   " if last_is_last_sub else "║  "
-                        elif depth < last_depth:
-                            tree_decoration = tree_decoration[:-3 * (last_depth - depth)]
-                    last_depth = depth
-                    last_is_last_sub = is_last_sub
-
-                    tmp += (tree_decoration + ("╠═ " if not is_last_sub else "╚═ "))[3:]
-                    tmp += "🖱️{}".format(searchable_node.concept_node.sub_tree_click_count)
-                    if node.has_sub_nodes:
-                        tmp += "📚{}".format(node.sub_tree_size - 1)
-                    path = searchable_node.get_path_under_alive_parent()
-                    tmp += DecoratedStr(path[:path.rfind('/') + 1], [BLUE])
-                    tmp += searchable_node.concept_node.decorated_name.content
-                    tmp += " " + node.summary
-                    if len(searchable_node.matched_keyword) > 0:
-                        tmp += " (🎯"
-                        tmp += DecoratedStr(",".join(searchable_node.matched_keyword), [YELLOW])
-                        tmp += ")"
-                    filtered_tui.append(tmp)
-
-                nodes_hidden = max(0, len(alive_searchable_nodes) - self.config.max_showing_nodes_when_searching)
-                if nodes_hidden:
-                    buf = " {} items hidden ".format(nodes_hidden)
-                    decorator = '-' * int(math.floor((self.config.tui_width - 3 - len(buf)) / 2))
-                    filtered_tui.append('{}{}{}'.format(decorator, buf, decorator))
+                alive_searchable_nodes, filtered_tui = self.render_search_result(search_engine, ranking)
 
                 self.tui.register_tui_block('select.1 filtering...', filtered_tui, True)
                 self.tui.register_tui_block('select.3 message', [
@@ -179,7 +274,12 @@ class Client(object):
                 def thinking() -> typing.Union[ConceptNode, str, None]:
                     previewing = None
                     while True:
-                        keyword = prompt('[{}] (enter idx or more keyword)  >  '.format(title))
+                        message = '[{}] (enter idx or more keyword)  >  '.format(title)
+                        if self.config.live_search:
+                            keyword = self.prompt_keywords_live(message, search_engine, ranking)
+                        else:
+                            from prompt_toolkit import prompt
+                            keyword = prompt(message)
                         if keyword.lower() in [":s", ":select"]:
                             if previewing is not None:
                                 return previewing.concept_node
@@ -200,6 +300,7 @@ class Client(object):
                             continue
                         return keyword
 
+                committed_keywords = search_engine.added_keywords
                 think_result = thinking()
                 if not isinstance(think_result, str):
                     self.tui.unregister_tui_block('select.1 filtering...')
@@ -208,7 +309,14 @@ class Client(object):
                     return think_result
                 if isinstance(think_result, str):
                     keyword = think_result
-                    search_engine.add_keywords(keyword)
+                    if keyword.lower() in [':r', ':rank']:
+                        ranking = not ranking
+                        continue
+                    if keyword.lower() in [':u', ':undo']:
+                        search_engine.undo_keyword()
+                        continue
+                    # no-op if keywords have been added while typing
+                    search_engine.set_keywords(committed_keywords + keyword.split(' '))
                     continue
                 assert think_result is None
                 raise KeyboardInterrupt()
@@ -257,15 +365,19 @@ class Client(object):
         if os.path.exists(path):
             raise ErrorCmdParams('{} already exists under {}'.format(dir_name, self.selected.path))
         os.mkdir(path)
-        new_node = ConceptNode(dir_name, self.config, self.selected)
-        with open(new_node.content_abs_path, 'w') as fd:
+        content_abs_path = os.path.join(path, 'index.md')
+        with open(content_abs_path, 'w') as fd:
             print('\n'.join(['', '---', '']), file=fd)
-        os.system("{} '{}'".format(EDITOR, new_node.content_abs_path))
-        new_node.refresh()
-        if not os.path.exists(new_node.content_abs_path):
+        os.system("{} '{}'".format(EDITOR, content_abs_path))
+        self.tui.invalidate()
+        if not os.path.exists(content_abs_path):
             self.tui.register_tui_block('mkdir.message', ['remove node as content unsaved or empty'], False)
-            os.rmdir(new_node.abs_path)
-        self.selected.refresh()
+            os.rmdir(path)
+        else:
+            new_node = self.selected.add_sub_node(dir_name)
+            if new_node is not None:
+                self.search_index.update(new_node)
+            self.notify_daemon(self.selected)
         self.cmd_ls('')
 
     def cmd_cat(self, params: str):
@@ -286,12 +398,18 @@ class Client(object):
             return
 
         target = self.select_from_listing(params)
-        if ask_confirm(DecoratedStr('delete {}'.format(target.decorated_path), RED)):
+        confirmed = ask_confirm(DecoratedStr('delete {}'.format(target.decorated_path), RED))
+        self.tui.invalidate()
+        if confirmed:
             self.tui.register_tui_block('rm.message', ['deleted: {}'.format(target.decorated_path)], False)
             shutil.rmtree(target.abs_path)
+            if self.config.click_journal is not None:
+                self.config.click_journal.remove(target.abs_path)
+            self.selected.remove_sub_node(target)
+            self.search_index.remove_sub_tree(target)
+            self.notify_daemon(self.selected)
         else:
             self.tui.register_tui_block('rm.message', ['canceled, nothing happened'], False)
-        self.selected.refresh()
         self.cmd_ls('')
 
     def cmd_vim(self, params: str):
@@ -306,13 +424,16 @@ class Client(object):
         else:
             raise ErrorCmdParams('unknown params: {}'.format(params))
         os.system("{} '{}'".format(EDITOR, target.content_abs_path))
-        target.refresh()
+        self.tui.invalidate()
+        if target.sync_content():
+            self.search_index.update(target)
+            self.notify_daemon(target)
         self.select(self.selected)
 
     def cmd_clear(self, params):
         if params:
             raise ErrorCmdParams('unknown params: {}'.format(params))
-        os.system(CLEAR_CMD)
+        self.tui.invalidate()
 
     def cmd_mv(self, params: str):
         if params == '-h':
@@ -359,7 +480,9 @@ class Client(object):
                     if node is target.parent:
                         continue
                     if node.name == target.parent.name:
-                        if ask_confirm('[smart move] move to {}'.format(node.path)):
+                        confirmed = ask_confirm('[smart move] move to {}'.format(node.path))
+                        self.tui.invalidate()
+                        if confirmed:
                             new_parent = node
                             break
 
@@ -373,15 +496,19 @@ class Client(object):
                 new_name = params[1]
                 confirm_msg = "move {} to {}".format(DecoratedStr(target.name, RED), DecoratedStr(new_name, GREEN))
                 confirm_msg = DecoratedStr(confirm_msg, RED)
-                if ask_confirm(confirm_msg):
+                confirmed = ask_confirm(confirm_msg)
+                self.tui.invalidate()
+                if confirmed:
                     new_abs_path = os.path.join(target.parent.abs_path, new_name)
                     if os.path.exists(new_abs_path):
                         notify(["node {} already exists".format(new_name)])
                         return
                     shutil.move(target.abs_path, new_abs_path)
-                    target.name = new_name
-                    target.refresh()
-                    target.parent.refresh()
+                    if self.config.click_journal is not None:
+                        self.config.click_journal.move(target.abs_path, new_abs_path)
+                    target.rename(new_name)
+                    self.search_index.update(target)
+                    self.notify_daemon(target.parent)
                     notify(["renamed to {}".format(new_name)])
                     self.cmd_ls('')
                     return
@@ -402,11 +529,14 @@ class Client(object):
             return
 
         shutil.move(target.abs_path, new_parent.abs_path)
+        if self.config.click_journal is not None:
+            self.config.click_journal.move(target.abs_path, os.path.join(new_parent.abs_path, target.name))
+        # keep the moved nodes (and their search index entries) instead of loading them again
         old_parent = target.parent
-        target.parent = new_parent
-        new_parent.refresh()
         if old_parent is not None:
-            old_parent.refresh()
+            old_parent.remove_sub_node(target)
+        new_parent.attach_sub_node(target)
+        self.notify_daemon(*[node for node in [old_parent, new_parent] if node is not None])
         self.cmd_ls('')
         self.select(self.selected)
         notify(['Succeed: node({}) moved to path({})'.format(target.name, new_parent.path)])
@@ -423,6 +553,19 @@ class Client(object):
         path_nodes.reverse()
         self.list(path_nodes)
 
+    def cmd_trace(self, params):
+        if params == '-h':
+            self.cmd_help('trace')
+            return
+        if params:
+            raise ErrorCmdParams('unknown params: {}'.format(params))
+        if not TRACER.enabled:
+            self.tui.register_tui_block('trace', ['not recorded, start with memory --profile or MEMORY_TRACE=1'],
+                                        False)
+            return
+        self.tui.register_tui_block('trace', TRACER.report() + ['dumped to {} on exit'.format(
+            self.config.trace_file_path)], False)
+
     def cmd_help(self, params):
         help_msg = []
         if not params or params == 'path':
@@ -482,6 +625,11 @@ class Client(object):
                          '      b.  [listing.idx]           the sub node show in listing',
                          '      c.  ..                      the parent node of selected']
 
+        if not params or params == 'trace':
+            help_msg += ['─' * 4] if len(help_msg) > 0 else []
+            help_msg += ['trace                             show timings and counters of hot paths',
+                         '  1.  trace                       only recorded with memory --profile or MEMORY_TRACE=1']
+
         if not params or params == 'exit':
             help_msg += ['─' * 4] if len(help_msg) > 0 else []
             help_msg += ['exit, quit, q, :q                 exit memory']
@@ -501,6 +649,7 @@ class Client(object):
         cmd_map.update({name: self.cmd_mv for name in ['mv', 'move']})
         cmd_map.update({name: self.cmd_exit for name in [':q', 'exit', 'quit', 'q']})
         cmd_map.update({name: self.cmd_path for name in ['path']})
+        cmd_map.update({name: self.cmd_trace for name in ['trace']})
 
         cmd_map.update({name: self.cmd_clear for name in ['clear']})
 
@@ -510,9 +659,28 @@ class Client(object):
                     '  3. [command] -h                 show help document of [command]']
         self.tui.register_tui_block('help.message', help_msg, False)
 
+        try:
+            self._loop(cmd_map)
+        finally:
+            if self.watcher is not None:
+                self.watcher.close()
+            if self.daemon is not None:
+                self.daemon.close()
+            self.tree_index.save(self.root)
+            if self.config.click_journal is not None:
+                self.config.click_journal.compact()
+            if self.config.content_store is not None:
+                self.config.content_store.save()
+            if TRACER.enabled:
+                TRACER.dump(self.config.trace_file_path)
+
+    def _loop(self, cmd_map: typing.Dict[str, typing.Callable]):
+        # imported on first use, so that headless commands don't pay for it, see batch.py
+        from prompt_toolkit import prompt
+
         while True:
             try:
-                self.cmd_clear('')
+                self.apply_external_changes()
                 self.tui.refresh()
                 cmd = prompt('memory > ')
                 cmd = cmd.strip()
@@ -1,15 +1,41 @@
 import json
 import os
+import sys
 import typing
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from .click_journal import ClickJournal
 from .config import Config
 from .decorated_str import *
+from .trace import TRACER
+
+
+def get_mtime(path: str) -> int:
+    """mtime of path in ns, -1 if path doesn't exist"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return -1
+
+
+def list_sub_dirs(path: str) -> typing.List[str]:
+    """names of directories under path, in os.listdir() order"""
+    with os.scandir(path) as entries:
+        # DirEntry.is_dir() is answered from readdir() on most file systems, no stat per entry
+        return [entry.name for entry in entries if entry.is_dir()]
 
 
 class ConceptNodeStatistics(object):
-    def __init__(self, path: str = None):
+    __slots__ = ['_path', '_data', '_journal', 'mtime']
+
+    def __init__(self, path: str = None, data: typing.Dict[str, int] = None, journal: ClickJournal = None):
         self._path = path
         self._data = {}  # type: typing.Dict[str, int]
-        self.load_if_exist()
+        self._journal = journal  # clicks go to journal instead of statistics.json if given
+        self.mtime = -1  # mtime of the file when it was last loaded or saved
+        if data is None:
+            self.load_if_exist()
+        else:
+            self._data.update(data)
 
     @property
     def path(self):
@@ -22,7 +48,12 @@ class ConceptNodeStatistics(object):
         self.load_if_exist()
 
     def load_if_exist(self):
-        if self._path is not None and os.path.exists(self._path):
+        if self._journal is not None and self._journal.consolidated:
+            # everything has been migrated into journal
+            self._data.setdefault('click', 0)
+            return
+        self.mtime = -1 if self._path is None else get_mtime(self._path)
+        if self.mtime != -1:
             with open(self._path, 'r') as fd:
                 try:
                     self._data = json.loads(''.join([line for line in fd]))
@@ -32,45 +63,109 @@ class ConceptNodeStatistics(object):
             self._data['click'] = 0
 
     def add_click_event(self):
-        self._data['click'] += 1
+        if self._journal is not None and self._path is not None:
+            self._journal.record_click(self._path)
+        else:
+            self._data['click'] += 1
 
     @property
     def click_count(self):
+        if self._journal is not None and self._path is not None:
+            return self._data['click'] + self._journal.clicks(self._path)
         return self._data['click']
 
+    @property
+    def file_click_count(self):
+        """clicks saved in statistics.json, those in journal excluded"""
+        return self._data['click']
+
+    @TRACER.timed('statistics.save')
     def save(self):
-        if self._path is None:
+        if self._path is None or self._journal is not None:
             return
         with open(self._path, 'w') as fd:
             print(json.dumps(self._data), file=fd)
+        self.mtime = get_mtime(self._path)
 
 
 class ConceptNode(object):
-    def __init__(self, name: str, config: Config, parent: "ConceptNode" = None):
+    """
+    a directory of workspace. only what is needed to list and search is kept in memory: name, summary and
+    statistics. full content of index.md is read from disk every time it is asked for (cat, preview, indexing)
+    """
+
+    # one instance per note, no __dict__ for each of them
+    __slots__ = ['_config', 'parent', '_sub_nodes', 'name', '_summary', '_statistics', 'path',
+                 '_sub_tree_size', '_sub_tree_click_count', 'content_mtime', 'sub_nodes_mtime']
+
+    def __init__(self, name: str, config: Config, parent: "ConceptNode" = None, lazy: bool = None):
         self._config = config
         self.parent = parent
-        self.sub_nodes = []  # type: typing.List[ConceptNode]
+        self._sub_nodes = None  # type: typing.Optional[typing.List[ConceptNode]]
 
-        self.name = name  # type: str
-        self.content = []  # type: typing.List[str]
+        self.name = sys.intern(name)  # type: str
+        self._summary = None  # type: typing.Optional[str]
 
-        self._statistics = ConceptNodeStatistics(None)
+        self._statistics = None  # type: typing.Optional[ConceptNodeStatistics]
 
         # self.searchable  note: don't use this memeber
 
         self.path = ""
-        self._sub_tree_size = 1
-        self._sub_tree_click_count = 0
-        self.refresh()
+        self._sub_tree_size = None  # type: typing.Optional[int]
+        self._sub_tree_click_count = None  # type: typing.Optional[int]
+
+        # mtime of index.md / directory when they were last read, see TreeIndex
+        self.content_mtime = -1
+        self.sub_nodes_mtime = -1
+
+        if config.lazy_load if lazy is None else lazy:
+            # everything else will be loaded the first time it is accessed
+            self._refresh_path()
+        else:
+            self._refresh_path()
+            self._load_sub_tree()
+        for listener in config.node_listeners:
+            listener(self)
 
     @property
     def sub_tree_click_count(self):
+        if self._sub_tree_click_count is None:
+            self._refresh_sub_tree_statistics()
         return self._sub_tree_click_count
 
     @property
-    def statistics(self):
+    def statistics(self) -> ConceptNodeStatistics:
+        if self._statistics is None:
+            self._statistics = ConceptNodeStatistics(self.statistics_abs_path, journal=self._config.click_journal)
         return self._statistics
 
+    @property
+    def click_count(self):
+        return self.statistics.click_count
+
+    @property
+    def sub_nodes(self) -> typing.List["ConceptNode"]:
+        if self._sub_nodes is None:
+            self._refresh_sub_nodes()
+        return self._sub_nodes
+
+    @property
+    def content(self) -> typing.List[str]:
+        """read from index.md on every access, not kept in memory"""
+        if self._config.content_store is not None:
+            return self._config.content_store.read(self.content_abs_path) or []
+        try:
+            with open(self.content_abs_path, 'r') as fd:
+                return [line for line in fd]
+        except FileNotFoundError:
+            return []
+
+    @property
+    def summary(self) -> str:
+        if self._summary is None:
+            self._refresh_content()
+        return self._summary
+
     @property
     def decorated_name(self):
         return DecoratedStr(self.name, GREEN)
@@ -97,74 +192,222 @@ class ConceptNode(object):
             cur += 1
         return res
 
+    @property
+    def loaded_nodes_below(self):
+        """same as all_nodes_below, but never loads sub nodes"""
+        res = [self]
+        cur = 0
+        while cur < len(res):
+            res += res[cur]._sub_nodes or []
+            cur += 1
+        return res
+
     @property
     def content_abs_path(self):
         return os.path.join(self.abs_path, "index.md")
 
+    @property
+    def statistics_abs_path(self):
+        return os.path.join(self.abs_path, "statistics.json")
+
     def _refresh_content(self):
-        path = self.content_abs_path
-        if os.path.exists(path):
-            with open(path, 'r') as fd:
-                self.content = [line for line in fd]
+        TRACER.count('concept.read_content')
+        self.content_mtime = get_mtime(self.content_abs_path)
+        if self.content_mtime == -1 and self._summary is not None:
+            return  # index.md is gone, keep what has been read
+        content = self.content
         summary_end_line = 0
-        while summary_end_line < len(self.content):
-            buf = self.content[summary_end_line].strip()
+        while summary_end_line < len(content):
+            buf = content[summary_end_line].strip()
             if len(buf) >= 3 and not buf.strip('-'):
                 break
             summary_end_line += 1
-        self.summary = " ".join([line.strip('\n') for line in self.content[:summary_end_line]])
+        self._summary = " ".join([line.strip('\n') for line in content[:summary_end_line]])
 
     @property
     def has_more_content(self):
         return len("".join([line.strip() for line in self.content])) > len(self.summary.strip()) + len("---")
 
-    def _refresh_sub_nodes(self):
+    def _load_sub_tree(self):
+        """load this node and everything below, level by level instead of recursively"""
+        nodes = [self]
+        idx = 0
+        while idx < len(nodes):
+            node = nodes[idx]
+            idx += 1
+            node._refresh_content()
+            node._refresh_sub_nodes(lazy=True)
+            nodes += node._sub_nodes
+        self._refresh_sub_tree_statistics()
+
+    def _refresh_sub_nodes(self, lazy: bool = None):
 
         # del
-        self.sub_nodes = [node for node in self.sub_nodes if os.path.exists(os.path.join(self.abs_path, node.name))]
+        sub_nodes = [node for node in self._sub_nodes or [] if os.path.exists(os.path.join(self.abs_path, node.name))]
 
         # add
-        cur_nodes = set([node.name for node in self.sub_nodes])
+        cur_nodes = set([node.name for node in sub_nodes])
 
         # check new
         abs_path = self.abs_path
-        for name in os.listdir(abs_path):
-            if name not in cur_nodes and os.path.isdir(os.path.join(abs_path, name)):
-                self.sub_nodes.append(ConceptNode(name, self._config, self))
+        TRACER.count('concept.list_dir')
+        self.sub_nodes_mtime = get_mtime(abs_path)
+        for name in list_sub_dirs(abs_path):
+            if name not in cur_nodes:
+                sub_nodes.append(ConceptNode(name, self._config, self, lazy))
                 cur_nodes.add(name)
 
-        self.sub_nodes.sort(key=lambda node: node.statistics.click_count, reverse=True)
+        sub_nodes.sort(key=lambda node: node.statistics.click_count, reverse=True)
+        self._sub_nodes = sub_nodes
 
     def _refresh_path(self):
-        if not self.parent:
-            self.path = self.name
-        else:
-            self.path = os.path.join(self.parent.path, self.name)
-        for node in self.sub_nodes:
-            node._refresh_path()
-
-        self._statistics.upd_path(os.path.join(self.abs_path, 'statistics.json'))
+        """update path of this node and of those loaded below"""
+        self.path = self.name if not self.parent else os.path.join(self.parent.path, self.name)
+        stack = [self]
+        while len(stack):
+            node = stack.pop()
+            for sub_node in node._sub_nodes or []:
+                sub_node.path = os.path.join(node.path, sub_node.name)
+                stack.append(sub_node)
+
+            if node._statistics is not None:
+                node._statistics.upd_path(node.statistics_abs_path)
+
+    def _refresh_sub_tree_statistics(self):
+        """compute sub tree statistics of self and of those nodes below whose statistics are still unknown"""
+        nodes = [self]
+        idx = 0
+        while idx < len(nodes):
+            nodes += [node for node in nodes[idx].sub_nodes if node._sub_tree_size is None]
+            idx += 1
+        for node in reversed(nodes):
+            node._sub_tree_size = 1 + sum([sub_node._sub_tree_size for sub_node in node.sub_nodes])
+            node._sub_tree_click_count = node.statistics.click_count + sum(
+                [sub_node._sub_tree_click_count for sub_node in node.sub_nodes])
 
     def after_click(self):
         """this func will be called after this node be clicked"""
-        self._statistics.add_click_event()
-        self._statistics.save()
+        self.statistics.add_click_event()
+        self.statistics.save()
         self.after_sub_tree_click()
 
     def after_sub_tree_click(self):
-        self._sub_tree_click_count += 1
-        if self.parent is not None:
-            self.parent.after_sub_tree_click()
+        node = self
+        while node is not None:
+            if node._sub_tree_click_count is not None:
+                node._sub_tree_click_count += 1
+            node = node.parent
 
-    def refresh(self):
-        # TODO: 没必要的话不刷新
+    def _after_sub_tree_changed(self, node: "ConceptNode", sign: int):
+        """node is attached (sign=1) to or detached (sign=-1) from sub tree, update statistics up to root"""
+        known = node.has_sub_tree_statistics
+        size_delta = sign * node.sub_tree_size if known else 0
+        click_delta = sign * node.sub_tree_click_count if known else 0
+        cur = self
+        while cur is not None:
+            if not known:
+                # don't load the whole sub tree of node, compute again when needed
+                cur._sub_tree_size = None
+                cur._sub_tree_click_count = None
+            elif cur._sub_tree_size is not None:
+                cur._sub_tree_size += size_delta
+                cur._sub_tree_click_count += click_delta
+            cur = cur.parent
+
+    def add_sub_node(self, name: str) -> typing.Optional["ConceptNode"]:
+        """directory `name` is created under this node, return the new node, None if nothing added"""
+        if self._sub_nodes is None:
+            return None  # will be listed on first access
+        for node in self._sub_nodes:
+            if node.name == name:
+                return None
+        if not os.path.isdir(os.path.join(self.abs_path, name)):
+            return None
+        node = ConceptNode(name, self._config, self)
+        self.attach_sub_node(node)
+        return node
+
+    def attach_sub_node(self, node: "ConceptNode"):
+        """node is moved under this node along with its sub tree"""
+        node.parent = self
+        node._refresh_path()
+        if self._sub_nodes is None:
+            return
+        self._sub_nodes.append(node)
+        self._sub_nodes.sort(key=lambda sub_node: sub_node.statistics.click_count, reverse=True)
+        self._after_sub_tree_changed(node, 1)
+
+    def remove_sub_node(self, node: "ConceptNode") -> bool:
+        """node is removed or moved away from this node"""
+        if self._sub_nodes is None or node not in self._sub_nodes:
+            return False
+        self._sub_nodes.remove(node)
+        self._after_sub_tree_changed(node, -1)
+        return True
+
+    def rename(self, new_name: str):
+        self.name = sys.intern(new_name)
         self._refresh_path()
-        self._refresh_content()
-        self._refresh_sub_nodes()
 
-        self._sub_tree_size = 1 + sum([node._sub_tree_size for node in self.sub_nodes])
-        self._sub_tree_click_count = self.statistics.click_count + sum(
-            [node._sub_tree_click_count for node in self.sub_nodes])
+    def reload_content(self):
+        if self._config.lazy_load:
+            self._summary = None
+        else:
+            self._refresh_content()
+
+    def sync_sub_nodes(self) -> typing.Tuple[typing.List["ConceptNode"], typing.List["ConceptNode"]]:
+        """re-list directory if it changed since listed last time, return (added, removed) nodes"""
+        if self._sub_nodes is None:
+            return [], []
+        abs_path = self.abs_path
+        mtime = get_mtime(abs_path)
+        if mtime == self.sub_nodes_mtime or mtime == -1:
+            return [], []
+        self.sub_nodes_mtime = mtime
+        names = list_sub_dirs(abs_path)
+
+        name_set = set(names)
+        removed = [node for node in self._sub_nodes if node.name not in name_set]
+        for node in removed:
+            self.remove_sub_node(node)
+
+        existing = set([node.name for node in self._sub_nodes])
+        added = [self.add_sub_node(name) for name in names if name not in existing]
+        return [node for node in added if node is not None], removed
+
+    def sync_content(self) -> bool:
+        """reload index.md if it changed since read last time, return True if reloaded"""
+        if self._summary is None or get_mtime(self.content_abs_path) in [-1, self.content_mtime]:
+            return False
+        self.reload_content()
+        return True
+
+    def get_loaded_node(self, path: str) -> typing.Optional["ConceptNode"]:
+        """node at path relative to this node, only loaded nodes are looked up"""
+        node = self
+        for name in path.split(os.path.sep):
+            if name in ['', '.']:
+                continue
+            sub_nodes = node._sub_nodes or []
+            node = None
+            for sub_node in sub_nodes:
+                if sub_node.name == name:
+                    node = sub_node
+                    break
+            if node is None:
+                return None
+        return node
+
+    @TRACER.timed('concept.refresh')
+    def refresh(self) -> bool:
+        """
+        re-read index.md and re-list directory only if they changed since read last time,
+        sub tree statistics of ancestors are updated by delta. return True if anything changed
+        """
+        self._refresh_path()
+        content_changed = self.sync_content()
+        added, removed = self.sync_sub_nodes()
+        return content_changed or len(added) > 0 or len(removed) > 0
 
     @property
     def has_sub_nodes(self):
@@ -172,8 +415,15 @@ class ConceptNode(object):
 
     @property
     def sub_tree_size(self):
+        if self._sub_tree_size is None:
+            self._refresh_sub_tree_statistics()
         return self._sub_tree_size
 
+    @property
+    def has_sub_tree_statistics(self):
+        """False if sub tree statistics are unknown yet, reading them will load the whole sub tree"""
+        return self._sub_tree_size is not None
+
     def is_ancestor_of(self, node: "ConceptNode"):
         while node is not None:
             if node == self:
@@ -181,6 +431,152 @@ class ConceptNode(object):
             node = node.parent
         return False
 
+    def dump(self) -> list:
+        """what has been loaded into memory, None for those not loaded. see restore()"""
+        return [self.sub_nodes_mtime if self._sub_nodes is not None else None,
+                self.content_mtime if self._summary is not None else None,
+                self._summary,
+                self._statistics.mtime if self._statistics is not None else None,
+                self._statistics.file_click_count if self._statistics is not None else None]
+
+    def restore(self, sub_nodes_mtime: typing.Optional[int], content_mtime: typing.Optional[int],
+                summary: typing.Optional[str], statistics_mtime: typing.Optional[int],
+                click_count: typing.Optional[int]) -> bool:
+        """
+        restore what dump() returned, anything changed on disk since then is left to be loaded lazily.
+        sub nodes are expected to be appended by caller, return False if they need to be re-listed.
+        """
+        if content_mtime is not None and content_mtime == get_mtime(self.content_abs_path):
+            self._summary = summary
+            self.content_mtime = content_mtime
+        journal = self._config.click_journal
+        if journal is not None and journal.consolidated:
+            # all clicks are in journal, the count dumped may be of statistics.json from before they were migrated
+            self._statistics = ConceptNodeStatistics(self.statistics_abs_path, {'click': 0}, journal)
+        elif statistics_mtime is not None and statistics_mtime == get_mtime(self.statistics_abs_path):
+            self._statistics = ConceptNodeStatistics(self.statistics_abs_path, {'click': click_count}, journal)
+            self._statistics.mtime = statistics_mtime
+        if sub_nodes_mtime is None:
+            return True
+        self._sub_nodes = []
+        self.sub_nodes_mtime = sub_nodes_mtime
+        return sub_nodes_mtime == get_mtime(self.abs_path)
+
+
+class TreeIndex(object):
+    """
+    snapshot of the loaded part of concept tree, kept as a single file under workspace.
+    startup loads it with one read and only validates mtimes, instead of walking the whole workspace.
+    """
+
+    VERSION = 1
+
+    def __init__(self, config: Config):
+        self._config = config
+
+    @property
+    def path(self):
+        return self._config.tree_index_file_path
+
+    @TRACER.timed('tree_index.load')
+    def load(self, root_name: str) -> typing.Optional[ConceptNode]:
+        if not self._config.tree_index:
+            return None
+        try:
+            with open(self.path, 'r') as fd:
+                data = json.load(fd)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != self.VERSION or data.get('root') != root_name:
+            return None
+
+        # records are in bfs order, so parent always comes first
+        nodes = []  # type: typing.List[ConceptNode]
+        outdated = []  # type: typing.List[ConceptNode]
+        for record in data['nodes']:
+            name, parent_idx, state = record[0], record[1], record[2:]
+            parent = nodes[parent_idx] if parent_idx >= 0 else None
+            node = ConceptNode(name, self._config, parent, lazy=True)
+            if parent is not None:
+                parent.sub_nodes.append(node)
+            if not node.restore(*state):
+                outdated.append(node)
+            nodes.append(node)
+
+        for node in outdated:
+            # parent is re-listed first, a removed node is dropped from tree then
+            if os.path.isdir(node.abs_path):
+                node._refresh_sub_nodes()
+        # dumped in the order of last session, clicks may have been recorded since, e.g. by journal of others
+        for node in nodes:
+            if node._sub_nodes is not None:
+                node._sub_nodes.sort(key=lambda sub_node: sub_node.statistics.click_count, reverse=True)
+        if len(nodes) == 0:
+            return None
+        if not self._config.lazy_load:
+            # whole tree is loaded as TreeLoader would, sub tree statistics are known then
+            nodes[0]._refresh_sub_tree_statistics()
+        return nodes[0]
+
+    @TRACER.timed('tree_index.save')
+    def save(self, root: ConceptNode):
+        if not self._config.tree_index:
+            return
+        # loaded_nodes_below is in bfs order, so parent always comes first
+        nodes = root.loaded_nodes_below
+        node_idx = {node: idx for (idx, node) in enumerate(nodes)}
+        records = [[node.name, node_idx[node.parent] if node is not root else -1] + node.dump() for node in nodes]
+
+        # write to a temp file first, so a crash never leaves a broken index behind
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as fd:
+            json.dump({'version': self.VERSION, 'root': root.name, 'nodes': records}, fd,
+                      ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+
+class TreeLoader(object):
+    """
+    cold load of the whole concept tree. directories, index.md and statistics.json are read by a pool of
+    `config.load_workers` threads, nodes are created and linked on the calling thread as results come in.
+    it pays off on file systems with high latency per call (network, overlay), where a serial walk mostly waits.
+    """
+
+    def __init__(self, config: Config):
+        self._config = config
+
+    @TRACER.timed('tree_loader.load')
+    def load(self, root_name: str) -> ConceptNode:
+        if self._config.lazy_load or self._config.load_workers <= 1:
+            return ConceptNode(root_name, self._config)
+
+        root = ConceptNode(root_name, self._config, lazy=True)
+        with ThreadPoolExecutor(max_workers=self._config.load_workers) as executor:
+            scanning = {executor.submit(TreeLoader._scan, root): root}
+            while len(scanning):
+                done, _ = wait(scanning, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node = scanning.pop(future)
+                    node._sub_nodes = [ConceptNode(name, self._config, node, lazy=True) for name in future.result()]
+                    for sub_node in node._sub_nodes:
+                        scanning[executor.submit(TreeLoader._scan, sub_node)] = sub_node
+
+        # same order as _refresh_sub_nodes(), statistics of all nodes are loaded now
+        for node in root.loaded_nodes_below:
+            node._sub_nodes.sort(key=lambda sub_node: sub_node.statistics.click_count, reverse=True)
+        root._refresh_sub_tree_statistics()
+        return root
+
+    @staticmethod
+    def _scan(node: ConceptNode) -> typing.List[str]:
+        """run by worker threads, only touches node itself. return names of its sub nodes"""
+        node._refresh_content()
+        _ = node.statistics
+        abs_path = node.abs_path
+        TRACER.count('concept.list_dir')
+        node.sub_nodes_mtime = get_mtime(abs_path)
+        return list_sub_dirs(abs_path)
+
 
 def simple_test():
     root = ConceptNode("example_concept", Config(os.getcwd()))
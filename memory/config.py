@@ -1,15 +1,81 @@
 import json
 import os
+import typing
+
+from .click_journal import ClickJournal
+from .content_store import ContentStore
+from .keyword_combiner import KeywordCombiner
 
 
 class Config:
-    def __init__(self, workspace: str, max_showing_nodes_when_searching=15):
+    def __init__(self, workspace: str, max_showing_nodes_when_searching=15, read_only: bool = False):
         self.workspace = workspace
         self.max_showing_nodes_when_searching = max_showing_nodes_when_searching
+        # caches under workspace are only read, for headless commands
+        self.read_only = read_only
 
         with open(self.user_config_file_path, 'r') as fd:
             self.user_config = json.loads("".join([line.strip() for line in fd]))
 
+        # load concept nodes on first access instead of walking the whole workspace on startup
+        self.lazy_load = self.user_config.get('lazy_load', False)  # type: bool
+        # threads reading the workspace when it is loaded as a whole, 1 for a serial walk, see TreeLoader
+        self.load_workers = self.user_config.get('load_workers', 1)  # type: int
+        # keep a snapshot of the concept tree under workspace to speed up startup, see TreeIndex
+        self.tree_index = self.user_config.get('tree_index', False)  # type: bool
+
+        # watch workspace and apply changes made outside memory, see TreeWatcher
+        self.watch = self.user_config.get('watch', False)  # type: bool
+        # called with every concept node created, e.g. by a watcher to watch the nodes loaded since last poll
+        self.node_listeners = []  # type: typing.List[typing.Callable]
+
+        # match keywords allowing a few typos when they match nothing as they are
+        self.fuzzy_search = self.user_config.get('fuzzy_search', False)  # type: bool
+        # filter while keywords are being typed when searching, see LiveSearch
+        self.live_search = self.user_config.get('live_search', False)  # type: bool
+        # show best matches first when searching instead of the filtered tree, switched by ':r' while searching
+        self.rank_search_results = self.user_config.get('rank_search_results', False)  # type: bool
+
+        self.keyword_combiner = KeywordCombiner(self.user_config.get('combines', None))
+
+        # buffer clicks and append them to one journal under workspace, instead of rewriting statistics.json
+        self.click_journal = None  # type: typing.Optional[ClickJournal]
+        if self.user_config.get('consolidated_statistics', False):
+            # keep all clicks in journal only, statistics.json of every node is migrated and no longer read
+            self.click_journal = ClickJournal(self.workspace, self.statistics_file_path, consolidated=True,
+                                            read_only=read_only)
+        elif self.user_config.get('click_journal', False):
+            self.click_journal = ClickJournal(self.workspace, self.click_journal_file_path)
+
+        # read index.md of unchanged nodes from one mmap-ed file instead of opening each of them
+        self.content_store = None  # type: typing.Optional[ContentStore]
+        if self.user_config.get('content_store', False):
+            self.content_store = ContentStore(self.workspace, self.content_store_file_path, read_only)
+
     @property
     def user_config_file_path(self):
         return os.path.join(self.workspace, 'config.json')
+
+    @property
+    def click_journal_file_path(self):
+        return os.path.join(self.workspace, '.memory_clicks.log')
+
+    @property
+    def statistics_file_path(self):
+        return os.path.join(self.workspace, '.memory_statistics.log')
+
+    @property
+    def tree_index_file_path(self):
+        return os.path.join(self.workspace, '.memory_index.json')
+
+    @property
+    def content_store_file_path(self):
+        return os.path.join(self.workspace, '.memory_content.pack')
+
+    @property
+    def trace_file_path(self):
+        return os.path.join(self.workspace, '.memory_trace.json')
+
+    @property
+    def daemon_socket_path(self):
+        return os.path.join(self.workspace, '.memory.sock')
@@ -0,0 +1,129 @@
+import io
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import typing
+
+_FOOTER_OFFSET = struct.Struct('<Q')
+
+
+class ContentStore(object):
+    """
+    index.md of every node packed into a single file under workspace, which is mmap-ed.
+
+    layout: content of all nodes one after another, then a json footer of
+    {path relative to workspace: [offset, length, mtime of index.md]}, then offset of the footer.
+    reading a node whose index.md hasn't changed slices the mapping instead of opening the file,
+    nothing is kept in python heap. changed or new ones are read from disk and spooled to an anonymous temp file,
+    until save() packs everything into a new file replacing the old one. the pack is never written in place,
+    other processes on the workspace may have it mapped. a read_only store only reads the pack.
+    """
+
+    VERSION = 1
+
+    def __init__(self, workspace: str, path: str, read_only: bool = False):
+        self.workspace = workspace
+        self.path = path
+        self.read_only = read_only
+        self._entries = {}  # type: typing.Dict[str, typing.List[int]]  # [offset, length, mtime]
+        self._pending = {}  # type: typing.Dict[str, typing.List[int]]  # [offset in spool, length, mtime]
+        self._spool = None  # type: typing.Optional[typing.BinaryIO]
+        self._mmap = None  # type: typing.Optional[mmap.mmap]
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        self._entries = {}
+        self._mmap = None
+        try:
+            with open(self.path, 'rb') as fd:
+                if os.fstat(fd.fileno()).st_size < _FOOTER_OFFSET.size:
+                    return
+                mapped = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError:
+            return
+        try:
+            footer_offset = _FOOTER_OFFSET.unpack_from(mapped, len(mapped) - _FOOTER_OFFSET.size)[0]
+            footer = json.loads(str(mapped[footer_offset:len(mapped) - _FOOTER_OFFSET.size], 'utf-8'))
+        except (struct.error, ValueError):
+            mapped.close()
+            return  # broken, packed again on save
+        if footer.get('version') != self.VERSION:
+            mapped.close()
+            return
+        self._entries = footer['entries']
+        self._mmap = mapped
+
+    def _key(self, abs_path: str) -> str:
+        return os.path.relpath(abs_path, self.workspace)
+
+    def read(self, abs_path: str) -> typing.Optional[typing.List[str]]:
+        """lines of file at abs_path, same as reading it in text mode. None if it doesn't exist"""
+        try:
+            mtime = os.stat(abs_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        key = self._key(abs_path)
+        with self._lock:
+            pending = self._pending.get(key, None)
+            entry = self._entries.get(key, None)
+            if pending is not None and pending[2] == mtime:
+                data = self._read_spool(pending)  # type: typing.Union[bytes, memoryview]
+            elif pending is None and entry is not None and entry[2] == mtime:
+                data = memoryview(self._mmap)[entry[0]:entry[0] + entry[1]]
+            else:
+                data = None
+        if data is None:
+            with open(abs_path, 'r') as fd:
+                text = fd.read()
+            if not self.read_only:
+                data = text.encode('utf-8', 'surrogateescape')
+                with self._lock:
+                    if self._spool is None:
+                        self._spool = tempfile.TemporaryFile()
+                    offset = self._spool.seek(0, io.SEEK_END)
+                    self._spool.write(data)
+                    self._pending[key] = [offset, len(data), mtime]
+        else:
+            text = str(data, 'utf-8', 'surrogateescape')
+        return [line for line in io.StringIO(text)]
+
+    def _read_spool(self, pending: typing.List[int]) -> bytes:
+        """called with lock held"""
+        self._spool.seek(pending[0])
+        return self._spool.read(pending[1])
+
+    def save(self):
+        """pack what changed since loaded, entries whose file is gone are dropped"""
+        with self._lock:
+            if len(self._pending) == 0:
+                return
+            # another process may be saving too, the last one replacing the pack wins
+            tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+            entries = {}  # type: typing.Dict[str, typing.List[int]]
+            offset = 0
+            with open(tmp_path, 'wb') as fd:
+                for key in set(self._entries) | set(self._pending):
+                    if not os.path.exists(os.path.join(self.workspace, key)):
+                        continue
+                    if key in self._pending:
+                        data, mtime = self._read_spool(self._pending[key]), self._pending[key][2]
+                    else:
+                        entry_offset, length, mtime = self._entries[key]
+                        data = memoryview(self._mmap)[entry_offset:entry_offset + length]
+                    fd.write(data)
+                    entries[key] = [offset, len(data), mtime]
+                    offset += len(data)
+                fd.write(json.dumps({'version': self.VERSION, 'entries': entries}, ensure_ascii=False,
+                                    separators=(',', ':')).encode('utf-8'))
+                fd.write(_FOOTER_OFFSET.pack(offset))
+                fd.flush()
+                os.fsync(fd.fileno())
+            os.replace(tmp_path, self.path)
+            self._pending = {}
+            self._spool.close()
+            self._spool = None
+            self._open()
@@ -0,0 +1,131 @@
+import asyncio
+import json
+import os
+import signal
+import socket
+import typing
+
+from .batch import Workspace
+from .concept import TreeIndex, TreeLoader
+from .config import Config
+from .errors import ErrorRequest
+from .watcher import TreeWatcher
+
+
+class Daemon(object):
+    """
+    keeps the tree and search index of workspace loaded, serving requests of local processes over a unix socket,
+    so that they don't load workspace again on every run. see Workspace for requests.
+
+    a request is a json object {'op': ..., params...} on one line, answered by one line of
+    {'ok': true, 'result': ...} or {'ok': false, 'error': ...}. clients are served concurrently, their requests are
+    run one at a time on the event loop, which owns the tree.
+    """
+
+    def __init__(self, config: Config, root_name: str):
+        client = DaemonClient.connect(config)
+        if client is not None:
+            client.close()
+            raise ErrorRequest('a daemon is already serving {}'.format(config.daemon_socket_path))
+        self.config = config
+        self.tree_index = TreeIndex(config)
+        root = self.tree_index.load(root_name) or TreeLoader(config).load(root_name)
+        self.workspace = Workspace(config, root, TreeWatcher(root) if config.watch else None)
+
+    def handle(self, line: bytes) -> typing.Dict[str, typing.Any]:
+        try:
+            params = json.loads(line.decode())
+            op = params.pop('op')
+        except (ValueError, KeyError, AttributeError):
+            return {'ok': False, 'error': 'bad request: {}'.format(line[:80])}
+        try:
+            return {'ok': True, 'result': self.workspace.request(op, **params)}
+        except (ErrorRequest, OSError) as err:
+            return {'ok': False, 'error': str(err)}
+        except Exception as err:
+            # keep serving others, the tree is left as the failed request left it
+            return {'ok': False, 'error': '{}: {}'.format(type(err).__name__, err)}
+
+    async def _serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = self.handle(line)
+                writer.write(json.dumps(response, ensure_ascii=False).encode() + b'\n')
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            pass  # client is gone, or sent a line over limit of reader
+        finally:
+            writer.close()
+
+    def serve_forever(self):
+        """serve until SIGINT / SIGTERM, then save tree index and content store as Client.run() does on exit"""
+        path = self.config.daemon_socket_path
+        if os.path.exists(path):
+            os.unlink(path)  # left by a daemon which didn't exit cleanly
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        server = loop.run_until_complete(asyncio.start_unix_server(self._serve_client, path=path, limit=2 ** 24))
+        for signal_num in [signal.SIGINT, signal.SIGTERM]:
+            loop.add_signal_handler(signal_num, loop.stop)
+        print('serving {} on {}'.format(self.workspace.root.abs_path, path), flush=True)
+        try:
+            loop.run_forever()
+        finally:
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            loop.close()
+            if os.path.exists(path):
+                os.unlink(path)
+            self.workspace.close()
+            # click journal is not compacted, daemon records no click and would drop those of the interactive client
+            self.tree_index.save(self.workspace.root)
+            if self.config.content_store is not None:
+                self.config.content_store.save()
+
+
+class DaemonClient(object):
+    """connection to the daemon of a workspace, requests are the same as of Workspace"""
+
+    def __init__(self, sock: socket.socket):
+        self._sock = sock
+        self._file = sock.makefile('rwb')
+
+    @staticmethod
+    def connect(config: Config) -> typing.Optional["DaemonClient"]:
+        """None if no daemon is serving workspace of config"""
+        path = config.daemon_socket_path
+        if not hasattr(socket, 'AF_UNIX') or not os.path.exists(path):
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+        except OSError:
+            sock.close()
+            return None
+        return DaemonClient(sock)
+
+    def request(self, op: str, **params) -> typing.Any:
+        params['op'] = op
+        try:
+            self._file.write(json.dumps(params, ensure_ascii=False).encode() + b'\n')
+            self._file.flush()
+            line = self._file.readline()
+        except OSError as err:
+            raise ErrorRequest('daemon is gone: {}'.format(err))
+        if not line:
+            raise ErrorRequest('daemon is gone')
+        try:
+            response = json.loads(line.decode())
+            if not response['ok']:
+                raise ErrorRequest(response['error'])
+            return response['result']
+        except (ValueError, KeyError, TypeError):
+            raise ErrorRequest('bad reply from daemon: {}'.format(line[:80]))
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
@@ -1,4 +1,6 @@
+import re
 import typing
+import unicodedata
 
 PINK = '\033[95m'
 BLUE = '\033[94m'
@@ -9,25 +11,103 @@ BOLD = '\033[1m'
 UNDERLINE = '\033[4m'
 END = '\033[0m'
 
+_ESCAPE = re.compile(r'(\033\[[0-9;]*m)')
+_NON_ASCII = re.compile(r'[^\x00-\x7f]')
+
+
+def char_width(text: str) -> int:
+    """columns text takes in a terminal, wide chars (CJK, most emoji) take 2, combining marks take none"""
+    if _NON_ASCII.search(text) is None:
+        return len(text)
+    width = 0
+    for char in text:
+        if unicodedata.category(char) in ('Mn', 'Me', 'Cf'):
+            continue
+        width += 2 if unicodedata.east_asian_width(char) in ('W', 'F') else 1
+    return width
+
+
+def _cut(text: str, max_width: int) -> str:
+    """longest head of text at most max_width columns wide"""
+    if _NON_ASCII.search(text) is None:
+        return text[:max_width]
+    width = 0
+    for (idx, char) in enumerate(text):
+        width += char_width(char)
+        if width > max_width:
+            return text[:idx]
+    return text
+
 
 class DecoratedStr(object):
-    def __init__(self, content: str, decorators: typing.List[str] = None):
-        if decorators is None:
-            decorators = []
-        self.content = "{}{}{}".format("".join(decorators), content, END if len(decorators) else "")
-        self.decoration_len = sum([len(decorator) for decorator in decorators]) + (len(END) if len(decorators) else 0)
+    """
+    text with ANSI decorations, kept as segments of (text, columns it takes). escapes take no column.
+    += appends segments in place without copying what is there, width is counted once per segment.
+    """
+
+    __slots__ = ['_segments', '_width']
+
+    def __init__(self, content: str = "", decorators: typing.Union[str, typing.List[str]] = None):
+        self._segments = []  # type: typing.List[typing.Tuple[str, int]]
+        self._width = 0
+        if decorators:
+            self._segments.append(("".join(decorators), 0))
+        self._append(content)
+        if decorators:
+            self._segments.append((END, 0))
+
+    def _append(self, other: typing.Union["DecoratedStr", str]):
+        if isinstance(other, DecoratedStr):
+            self._segments += other._segments
+            self._width += other._width
+        elif '\033' in other:
+            # decorated by formatting a DecoratedStr into a str
+            for (idx, piece) in enumerate(_ESCAPE.split(other)):
+                if idx % 2:
+                    self._segments.append((piece, 0))
+                elif piece:
+                    self._append(piece)
+        elif other:
+            width = char_width(other)
+            self._segments.append((other, width))
+            self._width += width
 
     def __add__(self, other: typing.Union["DecoratedStr", str]) -> "DecoratedStr":
-        if isinstance(other, str):
-            res = DecoratedStr(self.content + other)
-            res.decoration_len = self.decoration_len
-        else:
-            res = DecoratedStr(self.content + other.content)
-            res.decoration_len = self.decoration_len + other.decoration_len
+        res = DecoratedStr()
+        res._segments = list(self._segments)
+        res._width = self._width
+        res._append(other)
         return res
 
+    def __iadd__(self, other: typing.Union["DecoratedStr", str]) -> "DecoratedStr":
+        self._append(other)
+        return self
+
+    @property
+    def content(self) -> str:
+        return "".join([text for (text, _) in self._segments])
+
+    def fold(self, max_width: int) -> str:
+        """content at most max_width columns wide, ending with '...' if cut. escapes are kept whole"""
+        if self._width <= max_width:
+            return self.content
+        width_left = max(max_width - 3, 0)
+        pieces = []  # type: typing.List[str]
+        decorated = False
+        for (text, width) in self._segments:
+            if width <= width_left:
+                pieces.append(text)
+                width_left -= width
+                decorated = decorated or text.startswith('\033')
+            else:
+                pieces.append(_cut(text, width_left))
+                break
+        pieces.append(END + "..." if decorated else "...")
+        return "".join(pieces)
+
     def __str__(self):
         return self.content
 
     def __len__(self):
-        return len(self.content) - self.decoration_len
+        """columns it takes in a terminal"""
+        return self._width
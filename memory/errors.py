@@ -4,3 +4,7 @@ class CmdNotFound(Exception):
 
 class ErrorCmdParams(Exception):
     pass
+
+
+class ErrorRequest(Exception):
+    pass
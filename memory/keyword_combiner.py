@@ -0,0 +1,133 @@
+import re
+import typing
+
+
+def combine_keywords(content: str, combines: typing.List[typing.List] = None) -> str:
+    """!!! this func will remove all space char"""
+    if combines is None:
+        return content
+    for keywords in combines:
+        if len(keywords) == 0:
+            continue
+        to = ' {} '.format(keywords[0])
+        for keyword in keywords[1:]:
+            keyword = keyword.lower()
+            content = content.replace(keyword.replace(' ', ''), to)
+    return content.replace(' ', '')
+
+
+class KeywordCombiner(object):
+    """
+    combine_keywords() compiled once, all synonyms are replaced in one pass of a single regex.
+
+    one pass gives the same result as replacing synonyms one by one only if no replacement can affect
+    another one: no synonym contains another or overlaps the head of an earlier one, and no synonym
+    appears in what an earlier one is replaced to. otherwise falls back to combine_keywords().
+    """
+
+    def __init__(self, combines: typing.List[typing.List[str]] = None):
+        self.combines = combines
+        self._replacements = {}  # type: typing.Dict[str, str]
+        self._pattern = None  # type: typing.Optional[typing.Pattern]
+        self.is_single_pass = True
+        if combines is None:
+            return
+
+        # (synonym, replace to) in the order combine_keywords() replaces them
+        replacing = []  # type: typing.List[typing.Tuple[str, str]]
+        for keywords in combines:
+            if len(keywords) == 0:
+                continue
+            to = ' {} '.format(keywords[0])
+            for keyword in keywords[1:]:
+                replacing.append((keyword.lower().replace(' ', ''), to))
+
+        self.is_single_pass = KeywordCombiner.__is_single_pass_safe(replacing)
+        if not self.is_single_pass:
+            return
+        for (synonym, to) in replacing:
+            self._replacements.setdefault(synonym, to)
+        if len(self._replacements):
+            self._pattern = re.compile('|'.join([re.escape(synonym) for synonym in self._replacements]))
+
+    @staticmethod
+    def __is_single_pass_safe(replacing: typing.List[typing.Tuple[str, str]]) -> bool:
+        first_position = {}  # type: typing.Dict[str, int]
+        last_position = {}  # type: typing.Dict[str, int]
+        for (idx, (synonym, _)) in enumerate(replacing):
+            first_position.setdefault(synonym, idx)
+            last_position[synonym] = idx
+        if '' in first_position:
+            return False
+
+        proper_prefixes = {}  # type: typing.Dict[str, typing.List[str]]
+        for synonym in first_position:
+            for end in range(1, len(synonym)):
+                proper_prefixes.setdefault(synonym[:end], []).append(synonym)
+
+        for synonym in first_position:
+            # contains another synonym
+            for begin in range(len(synonym)):
+                for end in range(begin + 1, len(synonym) + 1):
+                    if end - begin < len(synonym) and synonym[begin:end] in first_position:
+                        return False
+            # its tail is the head of an earlier synonym, one pass would match it first as it starts first
+            for begin in range(1, len(synonym)):
+                for other in proper_prefixes.get(synonym[begin:], []):
+                    if first_position[other] < first_position[synonym]:
+                        return False
+
+        # replaced to something a later synonym could match, synonyms never contain space
+        for (idx, (_, to)) in enumerate(replacing):
+            for word in to.split(' '):
+                for begin in range(len(word)):
+                    for end in range(begin + 1, len(word) + 1):
+                        if last_position.get(word[begin:end], -1) > idx:
+                            return False
+        return True
+
+    def combine(self, content: str) -> str:
+        """same as combine_keywords(content, combines)"""
+        if self.combines is None:
+            return content
+        if not self.is_single_pass:
+            return combine_keywords(content, self.combines)
+        if self._pattern is not None:
+            content = self._pattern.sub(lambda match: self._replacements[match.group(0)], content)
+        return content.replace(' ', '')
+
+
+def simple_test():
+    text = 'i write c++ and cpp, a cplusplus engin for py3 and python3 . engine-x'
+    for (combines, single_pass) in [
+        ([['c++', 'cpp', 'cplusplus'], ['python', 'py3'], ['engine', 'engin']], True),
+        ([['c++', 'cpp', 'cplus plus'], ['python', 'py3']], True),
+        ([['x', 'ab'], ['y', 'bc']], True),  # 'abc': 'ab' is matched first either way
+        ([['x', 'bc'], ['y', 'ab']], False),  # 'abc': 'ab' starts first but 'bc' is replaced first
+        ([['x', 'ab'], ['y', 'abc']], False),  # 'ab' is a prefix of 'abc'
+        ([['ab', 'q'], ['z', 'a']], False),  # 'a' is in what 'q' is replaced to
+        ([['z', 'a'], ['ab', 'q']], True),
+        ([['x', 'a b', 'ab'], ['y', 'ab']], True),  # same synonym twice, first one wins
+        ([['x', ' ']], False),
+        ([[], ['x']], True),
+        (None, True),
+    ]:
+        combiner = KeywordCombiner(combines)
+        assert combiner.is_single_pass is single_pass, combines
+        for content in [text, 'abcabc ab bc abab q qa', '']:
+            assert combiner.combine(content) == combine_keywords(content, combines), (combines, content)
+
+    # any table, single pass or not, gives what combine_keywords gives
+    import random
+    rand = random.Random(0)
+    for _ in range(3000):
+        combines = [[''.join(rand.choice('abc') for _ in range(rand.randint(1, 3)))
+                     for _ in range(rand.randint(1, 3))] for _ in range(rand.randint(1, 3))]
+        combiner = KeywordCombiner(combines)
+        for _ in range(10):
+            content = ''.join(rand.choice('abc ') for _ in range(rand.randint(0, 12)))
+            assert combiner.combine(content) == combine_keywords(content, combines), (combines, content)
+
+
+if __name__ == '__main__':
+    simple_test()
@@ -0,0 +1,60 @@
+import threading
+import typing
+
+from .search_engine import SearchEngine
+
+
+class LiveSearch(object):
+    """
+    filters while keywords are being typed.
+
+    matching runs on a worker thread which owns search engine until close(). a newer input cancels the
+    running one before its next keyword, and keywords already matched are kept, see SearchEngine.set_keywords().
+    what render() returns for the latest input is handed to on_result(), both called on the worker thread.
+    """
+
+    def __init__(self, search_engine: SearchEngine, render: typing.Callable[[SearchEngine], typing.Any],
+                 on_result: typing.Callable[[typing.Any], None]):
+        self.search_engine = search_engine
+        self.render = render
+        self.on_result = on_result
+
+        self._condition = threading.Condition()
+        self._generation = 0  # bumped by each input
+        self._keywords = None  # type: typing.Optional[typing.List[str]]  # latest input not taken yet
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def update(self, raw_keywords: typing.List[str]):
+        with self._condition:
+            self._generation += 1
+            self._keywords = raw_keywords
+            self._condition.notify()
+
+    def close(self):
+        """cancel what is running and wait for worker to exit, search engine is back to caller then"""
+        with self._condition:
+            self._generation += 1
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _is_cancelled(self, generation: int) -> bool:
+        return self._generation != generation
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._keywords is None and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                generation, keywords = self._generation, self._keywords
+                self._keywords = None
+
+            if not self.search_engine.set_keywords(keywords, lambda: self._is_cancelled(generation)):
+                continue
+            result = self.render(self.search_engine)
+            if not self._is_cancelled(generation):
+                self.on_result(result)
@@ -0,0 +1,128 @@
+import typing
+
+
+def substring_edit_distance(pattern: str, text: str) -> int:
+    """
+    min edit distance between pattern and any substring of text (Sellers' algorithm).
+    edits are insertion, deletion, substitution and transposition of adjacent chars (optimal string alignment)
+    """
+    # distances[i]: between pattern[:i] and the best substring ending at current char of text
+    distances = list(range(len(pattern) + 1))
+    last_distances = None  # type: typing.Optional[typing.List[int]]  # ending at last char
+    last_char = None  # type: typing.Optional[str]
+    best = distances[-1]
+    for char in text:
+        new_distances = [0]
+        for (idx, pattern_char) in enumerate(pattern):
+            distance = min(distances[idx + 1] + 1, new_distances[idx] + 1, distances[idx] + (pattern_char != char))
+            if idx > 0 and pattern_char == last_char and pattern[idx - 1] == char:
+                distance = min(distance, last_distances[idx - 1] + 1)
+            new_distances.append(distance)
+        last_distances, distances, last_char = distances, new_distances, char
+        best = min(best, distances[-1])
+    return best
+
+
+class NGramIndex(object):
+    """
+    inverted index from n-grams to the documents containing them.
+    answers 'which documents contain this substring' without scanning every document,
+    keywords shorter than n are answered by scanning, as they have no n-gram.
+    """
+
+    def __init__(self, n: int = 3):
+        self.n = n
+        self._postings = {}  # type: typing.Dict[str, typing.Set[typing.Hashable]]
+        self._documents = {}  # type: typing.Dict[typing.Hashable, str]
+
+    def _grams(self, content: str) -> typing.Set[str]:
+        return set([content[idx:idx + self.n] for idx in range(len(content) - self.n + 1)])
+
+    def get(self, key: typing.Hashable) -> typing.Optional[str]:
+        return self._documents.get(key, None)
+
+    def add(self, key: typing.Hashable, content: str):
+        if key in self._documents:
+            self.remove(key)
+        self._documents[key] = content
+        for gram in self._grams(content):
+            posting = self._postings.get(gram, None)
+            if posting is None:
+                posting = self._postings[gram] = set()
+            posting.add(key)
+
+    def remove(self, key: typing.Hashable):
+        content = self._documents.pop(key, None)
+        if content is None:
+            return
+        for gram in self._grams(content):
+            posting = self._postings[gram]
+            posting.discard(key)
+            if len(posting) == 0:
+                del self._postings[gram]
+
+    def find(self, keyword: str) -> typing.Set[typing.Hashable]:
+        """keys of all documents containing keyword, same as `content.find(keyword) != -1`"""
+        if len(keyword) < self.n:
+            return set([key for (key, content) in self._documents.items() if keyword in content])
+
+        # intersect from the rarest gram, candidates only shrink
+        postings = sorted([self._postings.get(gram, set()) for gram in self._grams(keyword)], key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if len(candidates) == 0:
+                break
+            candidates &= posting
+        if len(keyword) == self.n:
+            return candidates
+
+        # all grams present doesn't mean they are adjacent, verify
+        return set([key for key in candidates if keyword in self._documents[key]])
+
+    def find_fuzzy(self, keyword: str, max_distance: int) -> typing.Set[typing.Hashable]:
+        """
+        keys of all documents containing something within max_distance edits of keyword.
+        fewer edits are allowed if keyword is too short to be split into 2 * max_distance + 1 pieces of n chars
+        """
+        # split keyword into 2 * max_distance + 1 pieces. an edit breaks at most 2 of them (a transposition across
+        # two pieces), so at least one is left untouched and documents containing none of them are never checked
+        # pieces shorter than n would be looked up by scanning every document, allow fewer edits instead
+        max_distance = min(max_distance, (len(keyword) // self.n - 1) // 2)
+        if max_distance <= 0:
+            return self.find(keyword)
+        pieces_count = 2 * max_distance + 1
+        piece_len = len(keyword) // pieces_count
+        # an edit breaks at most n + 1 n-grams of keyword (a transposition), the others are in what matches
+        keyword_grams = [keyword[idx:idx + self.n] for idx in range(len(keyword) - self.n + 1)]
+        min_grams_kept = len(keyword_grams) - (self.n + 1) * max_distance
+        keyword_postings = [self._postings.get(gram, set()) for gram in keyword_grams]
+        res = set()  # type: typing.Set[typing.Hashable]
+        rejected = set()  # type: typing.Set[typing.Hashable]
+        window_matched = {}  # type: typing.Dict[str, bool]  # the same words show up again and again
+        for offset in range(0, piece_len * pieces_count, piece_len):
+            piece = keyword[offset:offset + piece_len] if offset + 2 * piece_len <= len(keyword) \
+                else keyword[offset:]
+            for key in self.find(piece):
+                if key in res or key in rejected:
+                    continue
+                # same check as for windows below, on the whole document through postings
+                if sum([key in posting for posting in keyword_postings]) < min_grams_kept:
+                    rejected.add(key)
+                    continue
+                content = self._documents[key]
+                # only around where the piece is, as far as the edits could shift it
+                start = content.find(piece)
+                while start != -1:
+                    window_begin = max(0, start - offset - max_distance)
+                    window = content[window_begin:start - offset + len(keyword) + max_distance]
+                    matched = window_matched.get(window, None)
+                    if matched is None:
+                        window_grams = self._grams(window)
+                        matched = window_matched[window] = \
+                            sum([gram in window_grams for gram in keyword_grams]) >= min_grams_kept and \
+                            substring_edit_distance(keyword, window) <= max_distance
+                    if matched:
+                        res.add(key)
+                        break
+                    start = content.find(piece, start + 1)
+        return res
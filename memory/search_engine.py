@@ -1,24 +1,73 @@
 from memory.concept import ConceptNode
+from memory.keyword_combiner import KeywordCombiner, combine_keywords
+from memory.ngram_index import NGramIndex
+from memory.trace import TRACER
+import heapq
 import typing
 
 
-def combine_keywords(content: str, combines: typing.List[typing.List] = None) -> str:
-    """!!! this func will remove all space char"""
-    if combines is None:
+def make_searchable(content: str, combiner: KeywordCombiner) -> str:
+    content = ''.join([char for char in content if char not in ['-', ' ', '_', '.']]).lower()
+    return combiner.combine(content)
+
+
+class SearchIndex(object):
+    """
+    searchable content of concept nodes, kept alive across searches.
+    nodes are indexed the first time they are searched, owner should call update() / remove_sub_tree()
+    after content of a node changed or nodes are removed.
+    """
+
+    def __init__(self, combiner: KeywordCombiner):
+        self.combiner = combiner
+        self._index = NGramIndex()
+
+    def searchable_content(self, node: ConceptNode) -> str:
+        content = self._index.get(node)
+        if content is None:
+            content = self.update(node)
+        return content
+
+    def update(self, node: ConceptNode) -> str:
+        content = make_searchable(node.name + ''.join(node.content), self.combiner)
+        self._index.add(node, content)
         return content
-    for keywords in combines:
-        if len(keywords) == 0:
-            continue
-        to = ' {} '.format(keywords[0])
-        for keyword in keywords[1:]:
-            keyword = keyword.lower()
-            content = content.replace(keyword.replace(' ', ''), to)
-    return content.replace(' ', '')
+
+    def remove_sub_tree(self, root: ConceptNode):
+        for node in root.loaded_nodes_below:
+            self._index.remove(node)
+
+    def find(self, keyword: str) -> typing.Set[ConceptNode]:
+        TRACER.count('search_index.find')
+        return self._index.find(keyword)
+
+    def find_fuzzy(self, keyword: str, max_distance: int) -> typing.Set[ConceptNode]:
+        TRACER.count('search_index.find_fuzzy')
+        return self._index.find_fuzzy(keyword, max_distance)
+
+
+class AliveStateLog(object):
+    """
+    states of searchable nodes before each keyword was added, so that keywords can be undone.
+    a node is saved the first time it changes after a keyword is added, undoing costs O(nodes changed)
+    """
+
+    def __init__(self):
+        self.steps = []  # type: typing.List[typing.Dict[SearchableNode, typing.Tuple]]
+
+    def save(self, node: "SearchableNode"):
+        if len(self.steps) and node not in self.steps[-1]:
+            self.steps[-1][node] = node.get_state()
 
 
 class SearchableNode(object):
-    def __init__(self, node: ConceptNode, parent: "SearchableNode" = None,
-                 combines: typing.List[typing.List[str]] = None):
+    __slots__ = ['concept_node', 'matched_keyword', 'is_alive', 'parent', 'sub_nodes', 'depth', 'searchable_content',
+                 '__cached_alive_parent', '__cached_sub_alive_nodes', 'alive_depth', 'is_last_alive_sub_node',
+                 'state_log']
+
+    def __init__(self, node: ConceptNode, parent: "SearchableNode" = None, searchable_content: str = "",
+                 state_log: AliveStateLog = None):
+        self.state_log = state_log  # changes are saved to it before made, if given
         self.concept_node = node
         self.matched_keyword = set()
         self.is_alive = False
@@ -27,11 +76,7 @@ class SearchableNode(object):
         if self.parent is not None:
             self.parent.sub_nodes.append(self)
         self.depth = 0 if self.parent is None else self.parent.depth + 1
-        self.searchable_content = self.concept_node.name + ''.join(self.concept_node.content)
-        self.searchable_content = ''.join([char for char in self.searchable_content if
-                                           char not in ['-', ' ', '_', '.']]).lower()
-
-        self.searchable_content = combine_keywords(self.searchable_content, combines)
+        self.searchable_content = searchable_content
 
         self.__cached_alive_parent = None  # type: typing.Optional[SearchableNode]
         self.__cached_sub_alive_nodes = self.sub_nodes.copy()
@@ -40,26 +85,52 @@ class SearchableNode(object):
         self.alive_depth = 0
         self.is_last_alive_sub_node = False
 
+    def get_state(self) -> typing.Tuple:
+        return (self.is_alive, set(self.matched_keyword), self.__cached_alive_parent,
+                self.__cached_sub_alive_nodes.copy())
+
+    def set_state(self, state: typing.Tuple):
+        self.is_alive, self.matched_keyword, self.__cached_alive_parent, self.__cached_sub_alive_nodes = state
+
+    def __save_state(self):
+        if self.state_log is not None:
+            self.state_log.save(self)
+
     def die(self):
+        self.__save_state()
         self.is_alive = False
 
+    def revive(self):
+        self.__save_state()
+        self.is_alive = True
+
+    def add_matched_keyword(self, keyword: str):
+        self.__save_state()
+        self.matched_keyword.add(keyword)
+
     def set_alive_parent(self, node: "SearchableNode"):
+        self.__save_state()
         self.__cached_alive_parent = node
         if node is not None:
+            node.__save_state()
             node.__cached_sub_alive_nodes.append(self)
 
     def get_alive_parent(self) -> typing.Optional["SearchableNode"]:
-        if self.__cached_alive_parent is None:
-            return None
-        if self.__cached_alive_parent.is_alive:
-            return self.__cached_alive_parent
-        latest_alive_parent = self.__cached_alive_parent.get_alive_parent()
-        if latest_alive_parent != self.__cached_alive_parent:
-            self.set_alive_parent(latest_alive_parent)
-        return self.__cached_alive_parent
+        # follow cached alive parents until an alive one, then point every node passed by to it
+        passed_by = [self]
+        while passed_by[-1].__cached_alive_parent is not None and not passed_by[-1].__cached_alive_parent.is_alive:
+            passed_by.append(passed_by[-1].__cached_alive_parent)
+        latest_alive_parent = passed_by[-1].__cached_alive_parent
+        for node in reversed(passed_by):
+            if latest_alive_parent != node.__cached_alive_parent:
+                node.set_alive_parent(latest_alive_parent)
+        return latest_alive_parent
 
     def get_sub_alive_nodes(self) -> typing.List["SearchableNode"]:
-        self.__cached_sub_alive_nodes = [node for node in self.__cached_sub_alive_nodes if node.is_alive]
+        sub_alive_nodes = [node for node in self.__cached_sub_alive_nodes if node.is_alive]
+        if len(sub_alive_nodes) != len(self.__cached_sub_alive_nodes):
+            self.__save_state()
+            self.__cached_sub_alive_nodes = sub_alive_nodes
         return self.__cached_sub_alive_nodes
 
     def get_path_under_alive_parent(self) -> str:
@@ -77,72 +148,117 @@ class SearchableNode(object):
 
 
 class SearchEngine(object):
-    def __init__(self, root: ConceptNode, combines: typing.List[typing.List[str]] = None):
-        self.combines = combines
-        self.root = SearchableNode(root, combines=combines)
+    @TRACER.timed('search_engine.init')
+    def __init__(self, root: ConceptNode, combines: typing.List[typing.List[str]] = None,
+                 index: SearchIndex = None, fuzzy: bool = False):
+        """
+        a filtering session under root, pass a long-lived index to avoid re-indexing on every search.
+        if fuzzy, a keyword matching nothing is matched again allowing a few typos, see fuzzy_distance()
+        """
+        self.index = index if index is not None else SearchIndex(KeywordCombiner(combines))
+        self.fuzzy = fuzzy
+        self._state_log = AliveStateLog()
+        self.root = SearchableNode(root, searchable_content=self.index.searchable_content(root),
+                                   state_log=self._state_log)
         self.alive_root = self.root
         self.alive_root.is_alive = True
         self.nodes = [self.root]  # type: typing.List[SearchableNode]
+        self._searchable_nodes = {root: self.root}  # type: typing.Dict[ConceptNode, SearchableNode]
         idx = 0
         while idx < len(self.nodes):
             node = self.nodes[idx]
             idx += 1
             for sub_node in node.concept_node.sub_nodes:
-                self.nodes.append(SearchableNode(sub_node, node, combines))
+                searchable_node = SearchableNode(sub_node, node, self.index.searchable_content(sub_node),
+                                                 self._state_log)
+                self._searchable_nodes[sub_node] = searchable_node
+                self.nodes.append(searchable_node)
         self.keywords = []  # type: typing.List[str]
         self.miss_keywords = []  # type: typing.List[str]
+        self._alive_count = None  # type: typing.Optional[int]
+        # (searchable keyword, nodes matched) of every keyword not missed, for ranking
+        self._keyword_matches = []  # type: typing.List[typing.Tuple[str, typing.Set[ConceptNode]]]
+        # raw keyword and state of engine before it was added, for undo, see AliveStateLog for nodes
+        self._added_keywords = []  # type: typing.List[typing.Tuple[str, typing.Tuple]]
 
-    def get_alive_leaves(self):
-        def __get_alive_leaves(root: SearchableNode) -> typing.List[SearchableNode]:
-            subs = root.get_sub_alive_nodes()
-            if len(subs) == 0:
-                return [root]
-            res = []
-            for node in subs:
-                res += __get_alive_leaves(node)
-            return res
-
-        return __get_alive_leaves(self.alive_root)
+    def get_alive_leaves(self) -> typing.List[SearchableNode]:
+        res = []
+        stack = [self.alive_root]
+        while len(stack):
+            node = stack.pop()
+            subs = node.get_sub_alive_nodes()
+            if len(subs):
+                stack += reversed(subs)
+            else:
+                res.append(node)
+        return res
 
+    @TRACER.timed('search_engine.dfs')
     def get_alive_nodes_in_dfs_order(self) -> typing.List[SearchableNode]:
-        res = []
+        return list(self.iter_alive_nodes_in_dfs_order())
 
-        def dfs(node: SearchableNode):
-            res.append(node)
-            subs = list(node.get_sub_alive_nodes())
+    def iter_alive_nodes_in_dfs_order(self) -> typing.Iterator[SearchableNode]:
+        """same as get_alive_nodes_in_dfs_order(), but nodes are only visited as far as they are consumed"""
+        self.alive_root.alive_depth = 0
+        stack = [self.alive_root]
+        while len(stack):
+            node = stack.pop()
+            yield node
+            subs = node.get_sub_alive_nodes()
             for sub_alive_node in subs:
                 sub_alive_node.is_last_alive_sub_node = sub_alive_node is subs[-1]
                 sub_alive_node.alive_depth = node.alive_depth + 1
-                dfs(sub_alive_node)
-
-        self.alive_root.alive_depth = 0
-        dfs(self.alive_root)
-        return res
+            stack += reversed(subs)
+
+    @property
+    def alive_count(self) -> int:
+        """number of alive nodes, counted once after each keyword"""
+        if self._alive_count is None:
+            self._alive_count = 0
+            stack = [self.alive_root]
+            while len(stack):
+                self._alive_count += 1
+                stack += stack.pop().get_sub_alive_nodes()
+        return self._alive_count
 
     @staticmethod
-    def __exist_keyword_strictly_under(root: SearchableNode, keyword: str):
-        for node in root.sub_nodes:
-            if node.searchable_content.find(keyword) != -1:
-                return True
-            if SearchEngine.__exist_keyword_strictly_under(node, keyword):
-                return True
-        return False
+    def __get_matched_ancestors(matched: typing.Set[SearchableNode]) -> typing.Set[SearchableNode]:
+        """nodes having any matched node strictly under them, every node is visited at most once"""
+        res = set()  # type: typing.Set[SearchableNode]
+        for node in matched:
+            node = node.parent
+            while node is not None and node not in res:
+                res.add(node)
+                node = node.parent
+        return res
 
+    @TRACER.timed('search_engine.add_keyword')
     def __add_keyword(self, raw_keyword: str):
-        keyword = ''.join([char for char in raw_keyword if char not in ['-', ' ', '_', '.']]).lower()
-
-        keyword = combine_keywords(keyword, self.combines)
+        self._added_keywords.append((raw_keyword, (self.alive_root, len(self.keywords), len(self.miss_keywords),
+                                                   len(self._keyword_matches))))
+        self._state_log.steps.append({})
+        self._alive_count = None
+        keyword = make_searchable(raw_keyword, self.index.combiner)
+        matched = set([self._searchable_nodes[node] for node in self.index.find(keyword)
+                       if node in self._searchable_nodes])  # type: typing.Set[SearchableNode]
+        if len(matched) == 0 and self.fuzzy and SearchEngine.fuzzy_distance(keyword) > 0:
+            matched = set([self._searchable_nodes[node]
+                           for node in self.index.find_fuzzy(keyword, SearchEngine.fuzzy_distance(keyword))
+                           if node in self._searchable_nodes])
+            if len(matched):
+                raw_keyword += '~'  # shown as matched fuzzily
+        matched_strictly_under = SearchEngine.__get_matched_ancestors(matched)
 
         keyword_matched_under_any_leaf = False
         alive_leaves = self.get_alive_leaves()
+        TRACER.count('search_engine.nodes_visited', len(matched) + len(matched_strictly_under) + len(alive_leaves))
         for alive_leaf in alive_leaves:
-            if SearchEngine.__exist_keyword_strictly_under(alive_leaf, keyword):
+            if alive_leaf in matched_strictly_under:
                 keyword_matched_under_any_leaf = True
                 break
         if not keyword_matched_under_any_leaf:
             # try reduce candidates
-            die_candidates = [alive_leaf for alive_leaf in alive_leaves
-                              if alive_leaf.searchable_content.find(keyword) == -1]
+            die_candidates = [alive_leaf for alive_leaf in alive_leaves if alive_leaf not in matched]
             if len(die_candidates) == len(alive_leaves):
                 self.miss_keywords.append(raw_keyword)
                 return
@@ -158,43 +274,52 @@ class SearchEngine(object):
 
         else:
             self.keywords.append(raw_keyword)
+        self._keyword_matches.append((keyword, set([node.concept_node for node in matched])))
 
         # update alive tree
 
         def get_alive_roots_strictly_under(root: SearchableNode) -> typing.List[SearchableNode]:
-            alive_roots = []
-            for _node in root.sub_nodes:
-                if _node.searchable_content.find(keyword) != -1:
-                    _node.is_alive = True
-                    _node.matched_keyword.add(raw_keyword)
-                    alive_roots.append(_node)
-                    continue
-                _sub_alive_roots = get_alive_roots_strictly_under(_node)
-                if len(_sub_alive_roots) == 0:
-                    continue
-                elif len(_sub_alive_roots) == 1:
-                    alive_roots.append(_sub_alive_roots[0])
+            # depth first with an explicit stack of (node, its sub nodes not visited yet, alive roots under it)
+            stack = [(root, iter(root.sub_nodes), [])]
+            while True:
+                node, sub_nodes, alive_roots = stack[-1]
+                for _node in sub_nodes:
+                    if _node in matched:
+                        _node.revive()
+                        _node.add_matched_keyword(raw_keyword)
+                        alive_roots.append(_node)
+                    elif _node in matched_strictly_under:
+                        stack.append((_node, iter(_node.sub_nodes), []))
+                        break
                 else:
-                    _node.is_alive = True
-                    for _sub_alive_root in _sub_alive_roots:  # type: SearchableNode
-                        _sub_alive_root.set_alive_parent(_node)
-                    alive_roots.append(_node)
-            return alive_roots
+                    # all sub nodes visited
+                    stack.pop()
+                    if len(stack) == 0:
+                        return alive_roots
+                    parent_alive_roots = stack[-1][2]
+                    if len(alive_roots) == 1:
+                        parent_alive_roots.append(alive_roots[0])
+                    elif len(alive_roots) > 1:
+                        node.revive()
+                        for _sub_alive_root in alive_roots:  # type: SearchableNode
+                            _sub_alive_root.set_alive_parent(node)
+                        parent_alive_roots.append(node)
 
         dropping_check_list = []  # type: typing.List[SearchableNode]
         new_leaves = []
         for alive_leaf in alive_leaves:
             is_real_leaf = len(alive_leaf.concept_node.sub_nodes) == 0
             if is_real_leaf:
-                if alive_leaf.searchable_content.find(keyword) != -1:
+                if alive_leaf in matched:
                     new_leaves.append(alive_leaf)
-                    alive_leaf.matched_keyword.add(keyword)
+                    alive_leaf.add_matched_keyword(keyword)
                     continue
 
-            sub_alive_roots = get_alive_roots_strictly_under(alive_leaf)
+            sub_alive_roots = get_alive_roots_strictly_under(alive_leaf) \
+                if alive_leaf in matched_strictly_under else []
             for sub_alive_root in sub_alive_roots:
                 new_leaves.append(sub_alive_root)
-            if alive_leaf.searchable_content.find(keyword) == -1 and len(sub_alive_roots) == 0:
+            if alive_leaf not in matched and len(sub_alive_roots) == 0:
                 alive_leaf.die()
                 dropping_check_list.append(alive_leaf.get_alive_parent())
                 for sub_alive_root in sub_alive_roots:
@@ -230,6 +355,88 @@ class SearchEngine(object):
                 que.append(parent)
         self.alive_root = que[-1]
 
+    @staticmethod
+    def fuzzy_distance(keyword: str) -> int:
+        """
+        edits allowed when matching keyword fuzzily, none for short ones as they would match almost anything.
+        keyword is split into 2 * distance + 1 pieces for NGramIndex.find_fuzzy(), each of them must be at least
+        a trigram long, or it would be looked up by scanning every note
+        """
+        if len(keyword) >= 3 * 5:
+            return 2
+        return 1 if len(keyword) >= 3 * 3 else 0
+
+    # where a keyword is matched, see score()
+    NAME_MATCH_WEIGHT = 3
+    SUMMARY_MATCH_WEIGHT = 2
+    BODY_MATCH_WEIGHT = 1
+
+    def score(self, node: SearchableNode) -> typing.Tuple[int, int, int]:
+        """(keywords matched, weight of where they are matched, clicks of sub tree), higher is better"""
+        matched_count = 0
+        match_weight = 0
+        searchable_name = None  # type: typing.Optional[str]
+        searchable_summary = None  # type: typing.Optional[str]
+        for (keyword, matched) in self._keyword_matches:
+            if node.concept_node not in matched:
+                continue
+            matched_count += 1
+            if searchable_name is None:
+                searchable_name = make_searchable(node.concept_node.name, self.index.combiner)
+            if keyword in searchable_name:
+                match_weight += SearchEngine.NAME_MATCH_WEIGHT
+                continue
+            if searchable_summary is None:
+                searchable_summary = make_searchable(node.concept_node.summary, self.index.combiner)
+            if keyword in searchable_summary:
+                match_weight += SearchEngine.SUMMARY_MATCH_WEIGHT
+            else:
+                match_weight += SearchEngine.BODY_MATCH_WEIGHT
+        return matched_count, match_weight, node.concept_node.sub_tree_click_count
+
+    @TRACER.timed('search_engine.rank')
+    def get_top_ranked_nodes(self, k: int) -> typing.List[SearchableNode]:
+        """best k alive nodes by score(), in a heap of k instead of sorting all. ties keep dfs order"""
+        return heapq.nlargest(k, self.iter_alive_nodes_in_dfs_order(), key=self.score)
+
+    @property
+    def added_keywords(self) -> typing.List[str]:
+        """all keywords added so far, missed ones included"""
+        return [raw_keyword for (raw_keyword, _) in self._added_keywords]
+
+    def undo_keyword(self) -> typing.Optional[str]:
+        """remove the keyword added last, restoring alive tree as before it. return it, None if no keyword"""
+        if len(self._added_keywords) == 0:
+            return None
+        raw_keyword, (self.alive_root, keywords_len, miss_keywords_len, keyword_matches_len) = \
+            self._added_keywords.pop()
+        for (node, state) in self._state_log.steps.pop().items():
+            node.set_state(state)
+        del self.keywords[keywords_len:]
+        del self.miss_keywords[miss_keywords_len:]
+        del self._keyword_matches[keyword_matches_len:]
+        self._alive_count = None
+        return raw_keyword
+
+    def set_keywords(self, raw_keywords: typing.List[str], is_cancelled: typing.Callable[[], bool] = None) -> bool:
+        """
+        make added_keywords the same as raw_keywords, only those after their common prefix are undone or added.
+        stop before adding next keyword once is_cancelled() returns True, return False then
+        """
+        raw_keywords = [keyword for keyword in raw_keywords if len(keyword) > 0]
+        added_keywords = self.added_keywords
+        common = 0
+        while common < min(len(added_keywords), len(raw_keywords)) and \
+                added_keywords[common] == raw_keywords[common]:
+            common += 1
+        for _ in range(len(added_keywords) - common):
+            self.undo_keyword()
+        for keyword in raw_keywords[common:]:
+            if is_cancelled is not None and is_cancelled():
+                return False
+            self.__add_keyword(keyword)
+        return True
+
     def add_keywords(self, raw_keywords: str):
         keywords = raw_keywords.split(' ')
         for keyword in keywords:
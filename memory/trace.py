@@ -0,0 +1,78 @@
+import functools
+import json
+import threading
+import time
+import typing
+
+
+class Tracer(object):
+    """
+    timings and counters of hot paths, recorded only when enabled (memory --profile, or MEMORY_TRACE=1).
+    when disabled, a traced call costs one attribute check.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._timings = {}  # type: typing.Dict[str, typing.List[float]]  # [calls, total seconds, max seconds]
+        self._counters = {}  # type: typing.Dict[str, int]
+        self._lock = threading.Lock()
+
+    def timed(self, name: str) -> typing.Callable:
+        """decorator recording how long each call of func takes"""
+
+        def decorator(func: typing.Callable) -> typing.Callable:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                begin = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - begin)
+
+            return wrapper
+
+        return decorator
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            timing = self._timings.get(name, None)
+            if timing is None:
+                timing = self._timings[name] = [0, 0.0, 0.0]
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    def count(self, name: str, value: int = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def report(self) -> typing.List[str]:
+        """human readable lines, slowest first"""
+        with self._lock:
+            timings = sorted(self._timings.items(), key=lambda item: item[1][1], reverse=True)
+            counters = sorted(self._counters.items())
+        lines = ['{:<32}{:>8}{:>12}{:>12}{:>12}'.format('timing', 'calls', 'total ms', 'avg ms', 'max ms')]
+        for (name, (calls, total, max_seconds)) in timings:
+            lines.append('{:<32}{:>8}{:>12.2f}{:>12.3f}{:>12.3f}'.format(
+                name, calls, total * 1e3, total / calls * 1e3, max_seconds * 1e3))
+        lines.append('{:<32}{:>8}'.format('counter', 'value'))
+        for (name, value) in counters:
+            lines.append('{:<32}{:>8}'.format(name, value))
+        return lines
+
+    def dump(self, path: str):
+        with self._lock:
+            data = {
+                'timings': {name: {'calls': calls, 'total': total, 'max': max_seconds}
+                            for (name, (calls, total, max_seconds)) in self._timings.items()},
+                'counters': dict(self._counters),
+            }
+        with open(path, 'w') as fd:
+            json.dump(data, fd, indent=2)
+
+
+TRACER = Tracer()
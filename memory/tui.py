@@ -1,7 +1,12 @@
 import os
+import shutil
 import sys
 
 from .decorated_str import *
+from .trace import TRACER
+
+
+CSI = '\033['
 
 
 class _TuiBlock(object):
@@ -13,13 +18,17 @@ class _TuiBlock(object):
 
 
 def fold_string(content: DecoratedStr, max_length) -> str:
-    return content.content if len(content) <= max_length else content.content[:max_length - 3] + "..."
+    return content.fold(max_length)
 
 
 class _TUI(object):
 
     def __init__(self):
         self.tui_blocks = {}  # type: typing.Dict[str, _TuiBlock]
+        self._frame = None  # type: typing.Optional[typing.List[str]]  # lines on screen, None if unknown
+        self._frame_size = None  # type: typing.Optional[typing.Tuple[int, int]]
+        if sys.platform == 'win32':
+            os.system('')  # turns on processing of the escapes _draw writes in Windows 10+ consoles
 
     def register_tui_block(self, title: str, content: typing.List[typing.Union[str, DecoratedStr]], keep_alive: bool):
         self.tui_blocks[title] = _TuiBlock(title, content, keep_alive)
@@ -28,23 +37,49 @@ class _TUI(object):
         if self.tui_blocks.get(title, None) is not None:
             del self.tui_blocks[title]
 
-    def _draw(self):
-        width = os.get_terminal_size().columns
+    @property
+    def width(self) -> int:
+        return shutil.get_terminal_size().columns
+
+    def invalidate(self):
+        """screen has been written by others (editor, prompt), draw it from scratch next time"""
+        self._frame = None
+
+    def _render(self, width: int) -> typing.List[str]:
+        frame = []  # type: typing.List[str]
         is_first_block = True
         for block in self.tui_blocks.values():
 
-            print('{}═══  {}  '.format("╔" if is_first_block else "╠", block.title).ljust(
-                width + len(block.title.content) - len(block.title), '═'))
+            title = DecoratedStr("╔═══  " if is_first_block else "╠═══  ") + block.title + "  "
+            frame.append(title.fold(width) + '═' * (width - len(title)))
             is_first_block = False
-            buf = DecoratedStr("")
+            if len(block.content) == 0:
+                frame.append('')
             for line in block.content:
-                if len(buf):
-                    buf += "\n"
-                buf += fold_string(DecoratedStr("║  ") + line, width - 5)
-            print(buf)
-        print('╚'.ljust(width, '═'))
+                frame += fold_string(DecoratedStr("║  ") + line, width - 5).split('\n')
+        frame.append('╚'.ljust(width, '═'))
+        return frame
+
+    def _draw(self):
+        """
+        rewrite only lines changed since last draw, in a single write. the prompt below the frame is cleared.
+        everything is redrawn if positions of last frame are unknown, e.g. the prompt may have scrolled screen
+        """
+        size = tuple(shutil.get_terminal_size())
+        frame = self._render(size[0])
+        if self._frame is None or self._frame_size != size or len(frame) + 2 > size[1]:
+            buf = [CSI + 'H', CSI + '2J', CSI + '3J', '\n'.join(frame), '\n']
+        else:
+            buf = ['{}{};1H{}2K{}'.format(CSI, row + 1, CSI, line) for (row, line) in enumerate(frame)
+                   if row >= len(self._frame) or self._frame[row] != line]
+            buf.append('{}{};1H{}J'.format(CSI, len(frame) + 1, CSI))
+        sys.stdout.write(''.join(buf))
+        sys.stdout.flush()
+        # a prompt under a frame filling the screen scrolls it
+        self._frame = frame if len(frame) + 2 <= size[1] else None
+        self._frame_size = size
 
+    @TRACER.timed('tui.refresh')
     def refresh(self):
-        os.system('cls' if sys.platform == "win32" else 'clear')
         self._draw()
         self.tui_blocks = {key: block for key, block in self.tui_blocks.items() if block.keep_alive}
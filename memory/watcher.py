@@ -0,0 +1,189 @@
+import ctypes
+import ctypes.util
+import os
+import struct
+import time
+import typing
+
+from .concept import ConceptNode
+
+# from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct('iIII')
+_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+class _Inotify(object):
+    """minimal non-blocking inotify binding through libc, raise OSError if inotify is unavailable"""
+
+    def __init__(self):
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError):
+            raise OSError('inotify is not supported')
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._wds = {}  # type: typing.Dict[str, int]
+        self._paths = {}  # type: typing.Dict[int, str]
+
+    def watch(self, path: str) -> bool:
+        """return False if already watched"""
+        if path in self._wds:
+            return False
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), _WATCH_MASK)
+        if wd < 0:
+            # e.g. ENOSPC when running out of fs.inotify.max_user_watches
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed: {}'.format(path))
+        self._wds[path] = wd
+        self._paths[wd] = path
+        return True
+
+    def unwatch_under(self, path: str):
+        prefix = path + os.path.sep
+        for watched in [watched for watched in self._wds if watched == path or watched.startswith(prefix)]:
+            wd = self._wds.pop(watched)
+            if self._paths.get(wd, None) == watched:
+                del self._paths[wd]
+                self._libc.inotify_rm_watch(self._fd, wd)
+
+    def read_events(self) -> typing.List[typing.Tuple[typing.Optional[str], str, int]]:
+        """(watched directory, name, mask) of all pending events"""
+        events = []
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                events.append((self._paths.get(wd, None), name, mask))
+
+    def close(self):
+        os.close(self._fd)
+
+
+class TreeWatcher(object):
+    """
+    keeps loaded concept nodes in sync with changes made outside memory (git pull, another editor ...).
+
+    uses inotify where available, nodes are watched as they are created, see Config.node_listeners.
+    otherwise mtimes of all loaded nodes are compared in rounds started every `poll_interval` seconds,
+    a poll spends at most `poll_budget` seconds on a round and the rest is left to the next polls.
+    nothing happens in background, changes are applied to the tree when poll() is called.
+    """
+
+    def __init__(self, root: ConceptNode, poll_interval: float = 2.0, poll_budget: float = 0.02):
+        self.root = root
+        self.poll_interval = poll_interval
+        self.poll_budget = poll_budget
+        self._last_poll_time = 0.0
+        self._polling = []  # type: typing.List[ConceptNode]  # left to check in current round, last first
+        self._unwatched = []  # type: typing.List[ConceptNode]  # created since last poll
+        self._inotify = None  # type: typing.Optional[_Inotify]
+        try:
+            self._inotify = _Inotify()
+        except OSError:
+            return
+        self._unwatched = root.loaded_nodes_below
+        root._config.node_listeners.append(self._node_created)
+
+    def _node_created(self, node: ConceptNode):
+        self._unwatched.append(node)
+
+    @property
+    def backend(self) -> str:
+        return 'inotify' if self._inotify is not None else 'polling'
+
+    def poll(self) -> typing.List[typing.Tuple[str, ConceptNode]]:
+        """apply changes since last poll, return [(change, node)], change is one of 'add', 'remove', 'content'"""
+        if self._inotify is not None:
+            try:
+                return self._poll_inotify()
+            except OSError:
+                self.close()
+        if len(self._polling) == 0:
+            if time.time() - self._last_poll_time < self.poll_interval:
+                return []
+            self._last_poll_time = time.time()
+            self._polling = self.root.loaded_nodes_below[::-1]
+        changes = []
+        deadline = time.time() + self.poll_budget
+        while len(self._polling) and time.time() < deadline:
+            nodes = self._polling[-256:]
+            del self._polling[-256:]
+            changes += self._sync(nodes, nodes)
+        return changes
+
+    def _watch_created(self) -> typing.List[typing.Tuple[str, ConceptNode]]:
+        """watch nodes created since last time, catch what changed before they are watched"""
+        nodes = [node for node in self._unwatched if os.path.isdir(node.abs_path)]
+        self._unwatched = []
+        newly_watched = [node for node in nodes if self._inotify.watch(node.abs_path)]
+        return self._sync(newly_watched, newly_watched)
+
+    def _poll_inotify(self) -> typing.List[typing.Tuple[str, ConceptNode]]:
+        changes = self._watch_created()
+
+        changed_dirs = []  # type: typing.List[ConceptNode]
+        changed_contents = []  # type: typing.List[ConceptNode]
+        moved_in = []  # type: typing.List[str]
+        for (dir_path, name, mask) in self._inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                # events are lost, check everything
+                return changes + self._sync(self.root.loaded_nodes_below, self.root.loaded_nodes_below)
+            if dir_path is None:
+                continue
+            if mask & IN_ISDIR and mask & (IN_DELETE | IN_MOVED_FROM):
+                self._inotify.unwatch_under(os.path.join(dir_path, name))
+            node = self.root.get_loaded_node(os.path.relpath(dir_path, self.root.abs_path))
+            if node is None:
+                continue
+            if mask & IN_ISDIR:
+                changed_dirs.append(node)
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    moved_in.append(os.path.join(node.path, name))
+            elif name == 'index.md':
+                changed_contents.append(node)
+        changes += self._sync(changed_dirs, changed_contents)
+
+        # nodes moved by memory itself are kept, not created again. watch them under their new path
+        for path in moved_in:
+            node = self.root.get_loaded_node(os.path.relpath(path, self.root.path))
+            if node is not None:
+                self._unwatched += node.loaded_nodes_below
+        return changes + self._watch_created()
+
+    @staticmethod
+    def _sync(dirs: typing.List[ConceptNode],
+              contents: typing.List[ConceptNode]) -> typing.List[typing.Tuple[str, ConceptNode]]:
+        changes = []
+        for node in dirs:
+            added, removed = node.sync_sub_nodes()
+            changes += [('add', added_node) for added_node in added]
+            changes += [('remove', removed_node) for removed_node in removed]
+        for node in contents:
+            if node.sync_content():
+                changes.append(('content', node))
+        return changes
+
+    def close(self):
+        """stop watching, polling goes on if poll() is called"""
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+            self.root._config.node_listeners.remove(self._node_created)
+            self._unwatched = []